@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+import argparse
+import socket
+import socketserver
+import threading
+import time
+from typing import Dict, List, Tuple, Any
+
+from librouteros.protocol import Encoder, Decoder, parse_word, cast_to_api
+
+
+Row = Dict[str, Any]
+
+
+class Wire(Encoder, Decoder):
+    """RouterOS API sentences over a socket, writes of concurrent commands are serialized"""
+
+    encoding = 'ASCII'
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.write_lock = threading.Lock()
+
+    def read(self, length: int) -> bytes:
+        data = b''
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk:
+                raise EOFError('Connection closed')
+            data += chunk
+        return data
+
+    def read_word(self) -> str:
+        length = self.read(1)
+        if length == b'\x00':
+            return ''
+        length += self.read(self.determineLength(length))
+        return self.read(self.decodeLength(length)).decode(self.encoding)
+
+    def read_sentence(self) -> List[str]:
+        return list(iter(self.read_word, ''))
+
+    def write(self, *words: str):
+        with self.write_lock:
+            self.sock.sendall(self.encodeSentence(*words))
+
+
+def compare(a: str, b: str) -> int:
+    """RouterOS ordering of two API values: .id and numbers by value, the rest as strings"""
+    if a.startswith('*') and b.startswith('*'):
+        a, b = int(a[1:], 16), int(b[1:], 16)
+    else:
+        try:
+            a, b = int(a), int(b)
+        except ValueError:
+            pass
+    return (a > b) - (a < b)
+
+
+def matches(row: Row, queries: List[str]) -> bool:
+    """Evaluate the ?query words of a print against a row"""
+    stack = []
+    for query in (q[1:] for q in queries):
+        if query.startswith('#'):
+            for op in query[1:]:
+                if op == '!':
+                    stack.append(not stack.pop())
+                elif op in '|&':
+                    b, a = stack.pop(), stack.pop()
+                    stack.append(a or b if op == '|' else a and b)
+                elif op == '.':
+                    stack.clear()
+                elif op.isdigit():
+                    stack.append(stack[int(op)])
+        elif query.startswith('-'):
+            stack.append(query[1:] not in row)
+        elif query[0] in '<>=':
+            name, value = query[1:].split('=', 1)
+            if name not in row:
+                stack.append(False)
+                continue
+            result = compare(cast_to_api(row[name]), value)
+            stack.append({'=': result == 0, '<': result < 0, '>': result > 0}[query[0]])
+        elif '=' in query:
+            name, value = query.split('=', 1)
+            stack.append(name in row and cast_to_api(row[name]) == value)
+        else:
+            stack.append(query in row)
+    return all(stack)
+
+
+class Router:
+    """
+    State of the fake device: menus as lists of rows, listen subscribers
+    and counters of the API sessions opened by the clients
+    """
+
+    def __init__(self, rows=100, latency=0.0, max_sessions=100):
+        self.lock = threading.RLock()
+        self.next_id = 1
+        self.tables: Dict[str, List[Row]] = {}
+        self.listeners: Dict[str, List[List[Tuple[Row, bool]]]] = {}
+        self.latency = latency  # seconds before every reply row
+        self.max_sessions = max_sessions
+        self.sessions = 0
+        self.peak_sessions = 0
+        self.logins = 0
+        for i in range(rows):
+            self.insert('/ip/address', {'address': f'10.{i // 65536}.{i // 256 % 256}.{i % 256}/32',
+                                        'interface': f'ether{i % 5}', 'disabled': i % 3 == 0})
+        for i in range(5):
+            self.insert('/interface', {'name': f'ether{i}', 'running': True, 'mtu': 1500})
+        self.tables['/system/resource'] = [{'version': '6.45.8 (stable)', 'board-name': 'fake'}]
+
+    def insert(self, path: str, row: Row) -> str:
+        with self.lock:
+            row = dict(row, **{'.id': f'*{self.next_id:X}'})
+            self.next_id += 1
+            self.tables.setdefault(path, []).append(row)
+            self.notify(path, row)
+            return row['.id']
+
+    def notify(self, path: str, row: Row, dead=False):
+        for queue in self.listeners.get(path, []):
+            queue.append((dict(row), dead))
+
+    def login(self) -> bool:
+        with self.lock:
+            if self.sessions >= self.max_sessions:
+                return False
+            self.sessions += 1
+            self.logins += 1
+            self.peak_sessions = max(self.peak_sessions, self.sessions)
+            return True
+
+    def logout(self):
+        with self.lock:
+            self.sessions -= 1
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class Handler(socketserver.BaseRequestHandler):
+    """One API session. Tagged commands run concurrently, untagged ones one by one"""
+
+    def handle(self):
+        router: Router = self.server.router
+        # rows are written one by one, don't let them wait for acks of the previous ones
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        wire = Wire(self.request)
+        self.cancelled: Dict[str, threading.Event] = {}
+        logged_in = False
+        try:
+            while True:
+                sentence = wire.read_sentence()
+                if not sentence:
+                    continue
+                cmd, attrs, api_attrs, queries = sentence[0], {}, {}, []
+                for word in sentence[1:]:
+                    if word.startswith('='):
+                        name, value = word[1:].split('=', 1)
+                        attrs[name] = value
+                    elif word.startswith('.'):
+                        name, value = word.split('=', 1)
+                        api_attrs[name] = value
+                    elif word.startswith('?'):
+                        queries.append(word)
+                tag = api_attrs.get('.tag')
+                tag_words = (f'.tag={tag}',) if tag is not None else ()
+                if cmd == '/login':
+                    if not router.login():
+                        wire.write('!fatal', 'too many sessions')
+                        return
+                    logged_in = True
+                    wire.write('!done', *tag_words)
+                elif cmd == '/cancel':
+                    for cancelled_tag, event in list(self.cancelled.items()):
+                        if attrs.get('tag') in (None, cancelled_tag):
+                            event.set()
+                    wire.write('!done', *tag_words)
+                else:
+                    event = self.cancelled[tag] = threading.Event()
+                    thread = threading.Thread(target=self.run, daemon=True,
+                                              args=(wire, cmd, attrs, queries, tag_words, event))
+                    thread.start()
+                    if tag is None:
+                        thread.join()
+        except (EOFError, OSError):
+            pass
+        finally:
+            if logged_in:
+                router.logout()
+
+    def run(self, wire: Wire, cmd: str, attrs: Dict[str, str], queries: List[str],
+            tag_words: Tuple[str, ...], cancelled: threading.Event):
+        router: Router = self.server.router
+        path, _, op = cmd.rpartition('/')
+        try:
+            if op == 'print':
+                proplist = attrs.get('.proplist')
+                with router.lock:
+                    rows = [dict(row) for row in router.tables.get(path, []) if matches(row, queries)]
+                for row in rows:
+                    if cancelled.is_set():
+                        wire.write('!trap', *tag_words, '=category=2', '=message=interrupted')
+                        break
+                    router.wait()
+                    if proplist:
+                        row = {k: v for k, v in row.items() if k in proplist.split(',')}
+                    wire.write('!re', *tag_words, *(f'={k}={cast_to_api(v)}' for k, v in row.items()))
+                wire.write('!done', *tag_words)
+            elif op == 'listen':
+                self.listen(wire, path, tag_words, cancelled)
+            elif op == 'add':
+                router.wait()
+                row_id = router.insert(path, {k: parse_word(f'={k}={v}')[1] for k, v in attrs.items()})
+                wire.write('!done', *tag_words, f'=ret={row_id}')
+            elif op in ('set', 'remove'):
+                router.wait()
+                self.modify(wire, path, op, attrs, tag_words)
+            else:
+                wire.write('!trap', *tag_words, '=message=no such command')
+                wire.write('!done', *tag_words)
+        except OSError:
+            pass
+
+    def listen(self, wire: Wire, path: str, tag_words: Tuple[str, ...], cancelled: threading.Event):
+        router: Router = self.server.router
+        queue: List[Tuple[Row, bool]] = []
+        with router.lock:
+            router.listeners.setdefault(path, []).append(queue)
+        try:
+            while not cancelled.is_set():
+                while queue:
+                    row, dead = queue.pop(0)
+                    wire.write('!re', *tag_words, *(f'={k}={cast_to_api(v)}' for k, v in row.items()),
+                               *(('=.dead=true',) if dead else ()))
+                time.sleep(0.01)
+            wire.write('!trap', *tag_words, '=category=2', '=message=interrupted')
+            wire.write('!done', *tag_words)
+        finally:
+            router.listeners[path].remove(queue)
+
+    def modify(self, wire: Wire, path: str, op: str, attrs: Dict[str, str], tag_words: Tuple[str, ...]):
+        router: Router = self.server.router
+        ids = attrs.pop('.id', '').split(',')
+        with router.lock:
+            table = router.tables.get(path, [])
+            by_id = {row['.id']: row for row in table}
+            if any(row_id not in by_id for row_id in ids):
+                wire.write('!trap', *tag_words, '=message=no such item')
+            else:
+                for row_id in ids:
+                    if op == 'set':
+                        by_id[row_id].update({k: parse_word(f'={k}={v}')[1] for k, v in attrs.items()})
+                        router.notify(path, by_id[row_id])
+                    else:
+                        table.remove(by_id[row_id])
+                        router.notify(path, {'.id': row_id}, dead=True)
+        wire.write('!done', *tag_words)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def serve(port=8728, bind='127.0.0.1', **router_args) -> Server:
+    """Start a fake router in background threads, its state is server.router"""
+    server = Server((bind, port), Handler)
+    server.router = Router(**router_args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Stand-in RouterOS API server for local measurements, no routers needed:
+# ./fake_router.py --rows 10000 --latency 0.001
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fake RouterOS API server')
+    parser.add_argument('--port', type=int, default=8728)
+    parser.add_argument('--bind', default='127.0.0.1')
+    parser.add_argument('--rows', type=int, default=100, help='rows in /ip/address')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before every reply row')
+    parser.add_argument('--max-sessions', type=int, default=100)
+    args = parser.parse_args()
+    server = serve(args.port, args.bind, rows=args.rows, latency=args.latency,
+                   max_sessions=args.max_sessions)
+    try:
+        while True:
+            time.sleep(10)
+            router = server.router
+            print(f'sessions {router.sessions}, peak {router.peak_sessions}, logins {router.logins}')
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple, Optional, Any
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import fake_router
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'mikrotik-rest')
+
+
+class AppClient:
+    """Requests to the Flask app imported in this process, one test client per thread"""
+
+    def __init__(self):
+        os.chdir(APP_DIR)
+        sys.path.insert(0, APP_DIR)
+        import app
+        self.flask_app = app.app.app
+        self.local = threading.local()
+
+    def request(self, method: str, url: str, body: Any = None) -> Tuple[int, Any]:
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.flask_app.test_client()
+        response = self.local.client.open(url, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Requests to a running server, e.g. uwsgi"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method: str, url: str, body: Any = None) -> Tuple[int, Any]:
+        data = json.dumps(body).encode() if body is not None else None
+        req = Request(self.base_url + url, data=data, method=method,
+                      headers={'Content-Type': 'application/json'})
+        try:
+            with urlopen(req) as response:
+                payload = response.read()
+                return response.status, json.loads(payload) if payload else None
+        except HTTPError as err:
+            return err.code, None
+
+
+class Workload:
+    """Requests of the mix on /ip/address. Rows are created by POST and removed by DELETE"""
+
+    def __init__(self, client, host: str, limit: int):
+        self.client = client
+        self.url = f'/v1/{host}/ip/address'
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.created: List[str] = []
+        self.counter = 0
+
+    def get(self) -> int:
+        return self.client.request('GET', f'{self.url}?limit={self.limit}')[0]
+
+    def post(self) -> int:
+        with self.lock:
+            self.counter += 1
+            n = self.counter
+        status, reply = self.client.request('POST', self.url, {
+            'address': f'192.168.{n // 256 % 256}.{n % 256}/32', 'interface': 'ether1'})
+        if status == 201:
+            with self.lock:
+                self.created.append(reply['.id'])
+        return status
+
+    def patch(self) -> int:
+        with self.lock:
+            row_id = random.choice(self.created) if self.created else None
+        if row_id is None:
+            return self.post()
+        return self.client.request('PATCH', f'{self.url}?ids={row_id}', {'comment': 'loadtest'})[0]
+
+    def delete(self) -> int:
+        with self.lock:
+            row_id = self.created.pop(random.randrange(len(self.created))) if self.created else None
+        if row_id is None:
+            return self.post()
+        return self.client.request('DELETE', f'{self.url}?ids={row_id}')[0]
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    weights = {}
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('get', 'post', 'patch', 'delete'):
+            raise ValueError(f'Unknown request kind {kind}')
+        weights[kind] = int(weight or 1)
+    return weights
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[round(q * (len(values) - 1))] if values else 0.0
+
+
+def run(workload: Workload, mix: Dict[str, int], concurrency: int,
+        duration: float, requests: Optional[int]) -> Tuple[Dict[str, List[Tuple[float, int]]], float]:
+    """Run the mix from `concurrency` threads, return latencies and statuses per kind and wall time"""
+    results: Dict[str, List[Tuple[float, int]]] = defaultdict(list)
+    kinds, weights = zip(*mix.items())
+    remaining = [requests]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with lock:
+                if remaining[0] is not None:
+                    if remaining[0] <= 0:
+                        return
+                    remaining[0] -= 1
+            kind = random.choices(kinds, weights)[0]
+            started = time.perf_counter()
+            status = getattr(workload, kind)()
+            results[kind].append((time.perf_counter() - started, status))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summary(results: Dict[str, List[Tuple[float, int]]], wall_time: float) -> Dict[str, Any]:
+    kinds = {kind: entries for kind, entries in sorted(results.items())}
+    kinds['all'] = [entry for entries in results.values() for entry in entries]
+    report: Dict[str, Any] = {
+        kind: {
+            'requests': len(entries),
+            'p50_ms': round(percentile([latency for latency, _ in entries], 0.5) * 1000, 2),
+            'p99_ms': round(percentile([latency for latency, _ in entries], 0.99) * 1000, 2),
+            'errors': sum(1 for _, status in entries if status >= 400),
+        } for kind, entries in kinds.items()
+    }
+    report['requests_per_s'] = round(len(kinds['all']) / wall_time, 1)
+    return report
+
+
+# Load test of mikrotik-rest against the fake router, no routers needed:
+# ./loadtest.py --concurrency 20 --duration 10 --mix get=70,post=10,patch=10,delete=10
+# With --url a running server (e.g. uwsgi connecting to 127.0.0.1) is driven over HTTP instead
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='mikrotik-rest load test')
+    parser.add_argument('--mix', default='get=70,post=10,patch=10,delete=10',
+                        help='weights of the request kinds')
+    parser.add_argument('--concurrency', type=int, default=10, help='clients sending requests at once')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to run')
+    parser.add_argument('--requests', type=int, help='stop after this number of requests')
+    parser.add_argument('--limit', type=int, default=100, help='rows per GET')
+    parser.add_argument('--url', help='base url of a running server, e.g. http://localhost:8080')
+    parser.add_argument('--host', default='127.0.0.1', help='router address used in the request urls')
+    parser.add_argument('--no-router', action='store_true', help="don't start the fake router")
+    parser.add_argument('--port', type=int, default=8728,
+                        help='fake router port, the app connects to it (with --url start the server '
+                             'with MIKROTIK_API_PORT set to it)')
+    parser.add_argument('--rows', type=int, default=1000, help='fake router rows in /ip/address')
+    parser.add_argument('--latency', type=float, default=0, help='fake router seconds per reply row')
+    parser.add_argument('--max-sessions', type=int, default=100, help='fake router session limit')
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    server = None if args.no_router else fake_router.serve(
+        args.port, rows=args.rows, latency=args.latency, max_sessions=args.max_sessions)
+    os.environ['MIKROTIK_API_PORT'] = str(args.port)  # read by settings.py when the app is imported
+    client = HttpClient(args.url) if args.url else AppClient()
+    workload = Workload(client, args.host, args.limit)
+    workload.get()  # warm up: connect and load the spec before measuring
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    results, wall_time = run(workload, parse_mix(args.mix), args.concurrency, args.duration, args.requests)
+
+    report = summary(results, wall_time)
+    if server:
+        report['router'] = {'sessions_opened': server.router.logins,
+                            'peak_sessions': server.router.peak_sessions}
+    if not args.url:  # ru_maxrss is in KiB on Linux
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        report['memory'] = {'peak_rss_growth_kib': rss_growth,
+                            'kib_per_concurrent_request': round(rss_growth / args.concurrency, 1)}
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f'{"":8}{"requests":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+        for kind in ('get', 'post', 'patch', 'delete', 'all'):
+            if kind in report:
+                stats = report[kind]
+                print(f'{kind:8}{stats["requests"]:>10}{stats["p50_ms"]:>10}{stats["p99_ms"]:>10}'
+                      f'{stats["errors"]:>8}')
+        print(f'{report["requests_per_s"]} requests/s')
+        if 'router' in report:
+            print(f'router sessions opened: {report["router"]["sessions_opened"]}, '
+                  f'at most {report["router"]["peak_sessions"]} at once')
+        if 'memory' in report:
+            print(f'peak RSS growth: {report["memory"]["peak_rss_growth_kib"]} KiB, '
+                  f'{report["memory"]["kib_per_concurrent_request"]} KiB per concurrent request')
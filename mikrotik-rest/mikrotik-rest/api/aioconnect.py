@@ -0,0 +1,221 @@
+import asyncio
+from itertools import count, chain
+from ssl import SSLContext
+from typing import Tuple, Dict, Optional, AsyncIterator, Iterable, Sequence, List
+from librouteros.exceptions import TrapError, ConnectionClosed, FatalError
+from librouteros.protocol import Encoder, Decoder, compose_word
+from settings import IDS_PER_COMMAND
+from .connect import MtEntry, Where, Command, CommandResult, parse_reply
+from .breaker import get_breaker, connect_errors
+from . import metrics
+
+
+Reply = Tuple[str, MtEntry]
+
+
+class AsyncApi(Encoder):
+    """
+    asyncio RouterOS API client.
+    Every command is tagged, so any number of them can run over one connection
+    at the same time: a single reader task routes replies to their callers.
+    """
+
+    encoding = 'ASCII'
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, timeout: float):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.replies: Dict[str, asyncio.Queue] = {}
+        self._tags = count()
+        self.closed = False
+        self._reader_task = asyncio.create_task(self._read_replies())
+
+    @classmethod
+    async def connect(cls, host: str, username: str, password: str, port: int = 8728,
+                      ssl: Optional[SSLContext] = None, timeout: float = 10,
+                      read_timeout: Optional[float] = None) -> 'AsyncApi':
+        """`timeout` limits connecting and login, `read_timeout` every reply afterwards"""
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=ssl, server_hostname=host if ssl else None),
+            timeout)
+        api = cls(reader, writer, timeout)
+        try:
+            await api.call('/login', compose_word('name', username), compose_word('password', password))
+        except BaseException:
+            api.close()
+            raise
+        if read_timeout is not None:
+            api.timeout = read_timeout
+        return api
+
+    async def _read_sentence(self) -> Tuple[str, ...]:
+        words = []
+        while True:
+            length = await self.reader.readexactly(1)
+            if length == b'\x00':
+                return tuple(words)
+            length += await self.reader.readexactly(Decoder.determineLength(length))
+            word = await self.reader.readexactly(Decoder.decodeLength(length))
+            words.append(word.decode(encoding=self.encoding, errors='strict'))
+
+    async def _read_replies(self):
+        try:
+            while True:
+                reply_word, *words = await self._read_sentence()
+                if reply_word == '!fatal':
+                    raise FatalError(words[0] if words else '')
+                tag, attrs = parse_reply(words)
+                queue = self.replies.get(tag)
+                if queue is not None:  # replies of cancelled commands are dropped
+                    queue.put_nowait((reply_word, attrs))
+        except (asyncio.IncompleteReadError, OSError, FatalError) as err:
+            error = err if isinstance(err, FatalError) else ConnectionClosed(f'Connection closed: {err}')
+            for queue in self.replies.values():
+                queue.put_nowait(error)
+        finally:
+            self.close()
+
+    def _write(self, cmd: str, *words: str):
+        if self.closed:
+            raise ConnectionClosed('Connection is closed')
+        self.writer.write(self.encodeSentence(cmd, *words))
+
+    async def _get(self, queue: asyncio.Queue) -> Reply:
+        reply = await asyncio.wait_for(queue.get(), self.timeout)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    async def stream(self, cmd: str, *words: str, limit: Optional[int] = None) -> AsyncIterator[MtEntry]:
+        """Same as LockedApi.stream, but doesn't block other commands on the connection"""
+        tag = str(next(self._tags))
+        queue = self.replies[tag] = asyncio.Queue()
+        done, trap, rows = False, None, 0
+        try:
+            self._write(cmd, *words, '.tag=' + tag)
+            await self.writer.drain()
+            while not done and (limit is None or rows < limit):
+                reply_word, attrs = await self._get(queue)
+                if reply_word == '!trap':
+                    trap = TrapError(**attrs)
+                    continue
+                done = reply_word == '!done'
+                if reply_word in ('!re', '!done') and attrs:
+                    rows += 1
+                    yield attrs
+        finally:
+            del self.replies[tag]
+            if not done and not self.closed:
+                self._write('/cancel', '=tag=' + tag)
+        if trap:
+            raise trap
+
+    async def call(self, cmd: str, *words: str) -> Tuple[MtEntry, ...]:
+        return tuple([row async for row in self.stream(cmd, *words)])
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+            if self._reader_task is not asyncio.current_task():
+                self._reader_task.cancel()
+
+
+class AsyncConnectionManager:
+    """
+    Single multiplexed connection per host, reopened when it breaks.
+    There is no pool: concurrent commands share the connection via tags.
+    """
+
+    def __init__(self, host: str, username: str, password: str, port: int = 8728,
+                 ssl: Optional[SSLContext] = None, timeout: float = 10, read_timeout: Optional[float] = None):
+        self.connect_args = {'host': host, 'username': username, 'password': password,
+                             'port': port, 'ssl': ssl, 'timeout': timeout, 'read_timeout': read_timeout}
+        self.breaker = get_breaker(host)
+        self.api: Optional[AsyncApi] = None
+        self.lock = asyncio.Lock()
+
+    async def _api(self) -> AsyncApi:
+        if self.api is None or self.api.closed:
+            async with self.lock:
+                if self.api is None or self.api.closed:
+                    self.breaker.check()
+                    try:
+                        with metrics.phase('connect'):
+                            self.api = await AsyncApi.connect(**self.connect_args)
+                    except connect_errors:
+                        self.breaker.record_failure(self._probe)
+                        raise
+                    self.breaker.record_success()
+        return self.api
+
+    def _probe(self):
+        """Connect and close from the breaker's probe thread, on an event loop of its own"""
+        async def probe():
+            (await AsyncApi.connect(**self.connect_args)).close()
+        asyncio.run(probe())
+
+    async def _cur(self, cmd: str, path: str, *words: str) -> Tuple[MtEntry, ...]:
+        api = await self._api()
+        return await api.call(path.rstrip('/') + '/' + cmd, *words)
+
+    async def add(self, path: str, params: MtEntry) -> str:
+        rows = await self._cur('add', path, *(compose_word(k, v) for k, v in params.items()))
+        return rows[0]['ret']
+
+    async def update(self, path: str, params: MtEntry):
+        await self._cur('set', path, *(compose_word(k, v) for k, v in params.items()))
+
+    async def remove(self, path: str, ids: Iterable[str]):
+        await self._cur('remove', path, compose_word('.id', ','.join(ids)))
+
+    async def batch(self, commands: Sequence[Command], window: int = 256) -> List[CommandResult]:
+        """
+        Commands run concurrently over the connection, at most `window` at once.
+        A trapped command doesn't stop the others, its TrapError is returned in place of rows
+        """
+        api = await self._api()
+        in_flight = asyncio.Semaphore(window)
+
+        async def run(cmd: str, words: Tuple[str, ...]) -> CommandResult:
+            async with in_flight:
+                try:
+                    return await api.call(cmd, *words)
+                except TrapError as err:
+                    return err
+
+        return list(await asyncio.gather(*(run(cmd, words) for cmd, words in commands)))
+
+    async def apply_where(self, cmd: str, path: str, params: MtEntry, where_fields: Tuple[Where, ...]) -> int:
+        """Same as ConnectionManager.apply_where"""
+        path = path.rstrip('/')
+        ids = [row['.id'] for row in await self.print(path, ('.id',), where_fields)]
+        words = tuple(compose_word(k, v) for k, v in params.items())
+        chunks = [ids[i:i + IDS_PER_COMMAND] for i in range(0, len(ids), IDS_PER_COMMAND)]
+        results = await self.batch([(path + '/' + cmd, words + (compose_word('.id', ','.join(chunk)),))
+                                    for chunk in chunks])
+        for result in results:
+            if isinstance(result, TrapError):
+                raise result
+        return len(ids)
+
+    async def stream(self, path: str, fields: Tuple[str, ...] = (),
+                     where_fields: Tuple[Where, ...] = (),
+                     limit: Optional[int] = None) -> AsyncIterator[MtEntry]:
+        words = []
+        if fields:
+            words.append('=.proplist=' + ','.join(fields))
+        words.extend(chain.from_iterable(where_fields))
+        api = await self._api()
+        rows = api.stream(path.rstrip('/') + '/print', *words, limit=limit)
+        try:
+            async for row in rows:
+                yield row
+        finally:
+            await rows.aclose()
+
+    async def print(self, path: str, fields: Tuple[str, ...] = (),
+                    where_fields: Tuple[Where, ...] = (),
+                    limit: Optional[int] = None) -> Tuple[MtEntry, ...]:
+        return tuple([row async for row in self.stream(path, fields, where_fields, limit)])
@@ -0,0 +1,50 @@
+from typing import Dict, Callable
+from connexion.utils import get_function_from_name
+from settings import USERNAME, PASSWORD, API_TRANSPORT
+from .apiendpoints import Endpoint
+from .aionode import AsyncNode
+from . import metrics
+
+
+class AsyncEndpoint(Endpoint):
+
+    async def __call__(self, **kwargs):
+        try:
+            metrics.set_host(kwargs['hostname'])
+            node = AsyncResolver.get_node(kwargs.pop('hostname'))
+            node_method = getattr(node, self.method)
+            result = await node_method(path=self.path, **kwargs)
+            metrics.mark('serialize')
+            return result
+        except tuple(Endpoint.error_codes) as err:
+            return Endpoint.error_response(err)
+
+
+class AsyncResolver:
+
+    nodes_cache: Dict[str, AsyncNode] = {}
+
+    @staticmethod
+    def get_node(hostname: str) -> AsyncNode:
+        # AsyncNode connects lazily, so creating it never blocks the event loop
+        node = AsyncResolver.nodes_cache.get(hostname)
+        if not node:
+            node = AsyncNode(hostname, USERNAME, PASSWORD, API_TRANSPORT == 'SSL')
+            AsyncResolver.nodes_cache[hostname] = node
+        return node
+
+
+def resolve_function(operation_id: str) -> Callable:
+    """
+    Connexion function resolver for the asgi app:
+    api.api.* operations are served by AsyncEndpoint,
+    everything else is resolved as usual and runs in a thread pool.
+    """
+    module, _, name = operation_id.rpartition('.')
+    if module != 'api.api':
+        return get_function_from_name(operation_id)
+    endpoint = AsyncEndpoint(name)
+
+    async def handler(**kwargs):
+        return await endpoint(**kwargs)
+    return handler
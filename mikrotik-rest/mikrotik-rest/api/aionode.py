@@ -0,0 +1,58 @@
+from typing import Tuple, Dict, Any, Optional, List
+import settings as setts
+from .aioconnect import AsyncConnectionManager
+from .aiostreaming import stream_response
+from .node import Node
+from .results import operation_result, bulk_status
+
+
+class AsyncNode:
+    """asyncio counterpart of Node, see Node for the meaning of the parameters"""
+
+    def __init__(self, host, username='admin', password='', use_ssl=False):
+        timeout, read_timeout = Node.host_timeouts(host)
+        port = setts.API_PORT or (8729 if use_ssl else 8728)
+        if use_ssl:
+            self.cm = AsyncConnectionManager(host, username, password, port, Node.create_ssl_context(),
+                                             timeout, read_timeout)
+        else:
+            self.cm = AsyncConnectionManager(host, username, password, port,
+                                             timeout=timeout, read_timeout=read_timeout)
+
+    async def post(self, path: str, body):
+        if isinstance(body, list):
+            return await self.post_many(path, body)
+        id = await self.cm.add(path, body)
+        return {'.id': id}, 201
+
+    async def post_many(self, path: str, entries: List[Dict[str, Any]]):
+        results = await self.cm.batch([Node.batch_command('post', path, entry) for entry in entries])
+        replies = [operation_result('post', res) for res in results]
+        return {'results': replies}, bulk_status(replies)
+
+    async def patch(self, path: str, body: Dict[str, Any], ids: Optional[Tuple[str, ...]] = None,
+                    where=None, any=None):
+        if not ids:
+            count = await self.cm.apply_where('set', path, body, Node.required_filter(where, any))
+            return {'count': count}, 200
+        body['.id'] = ','.join(ids)
+        await self.cm.update(path, body)
+        return None, 204  # No Content
+
+    async def get(self, path: str, limit: Optional[int] = None, fields=None, where=None,
+                  any=None, stream=None, cursor=None) -> Tuple[Dict[str, str], int]:
+        fields, where_fields = Node.prepare_query(limit, fields, where, any, cursor, path)
+        if stream:
+            return await stream_response(self.cm.stream(path, fields, where_fields, limit), stream)
+        fields, added_id = Node.page_fields(path, limit, fields)
+        return Node.page(path, limit, await self.cm.print(path, fields, where_fields, limit), added_id)
+
+    async def delete(self, path, id=None, ids=None, where=None, any=None):
+        if not (id or ids):
+            count = await self.cm.apply_where('remove', path, {}, Node.required_filter(where, any))
+            return {'count': count}, 200
+        if id:
+            await self.cm.remove(path, (id,))
+        if ids:
+            await self.cm.remove(path, ids)
+        return None, 204  # No Content
@@ -0,0 +1,58 @@
+import json
+from typing import AsyncIterator, Callable, Dict, Tuple
+from starlette.responses import StreamingResponse
+from .connect import MtEntry
+
+
+async def started(rows: AsyncIterator[MtEntry]) -> AsyncIterator[MtEntry]:
+    """Run the query up to its first row, so connection errors surface before the response starts"""
+    first = await rows.__anext__()
+
+    async def resume():
+        try:
+            yield first
+            async for row in rows:
+                yield row
+        finally:
+            await rows.aclose()
+    return resume()
+
+
+async def json_array(rows: AsyncIterator[MtEntry]) -> AsyncIterator[str]:
+    separator = ''
+    yield '['
+    try:
+        async for row in rows:
+            yield separator + json.dumps(row)
+            separator = ','
+    finally:
+        await rows.aclose()
+    yield ']\n'
+
+
+async def ndjson(rows: AsyncIterator[MtEntry]) -> AsyncIterator[str]:
+    try:
+        async for row in rows:
+            yield json.dumps(row) + '\n'
+    finally:
+        await rows.aclose()
+
+
+async def empty() -> AsyncIterator[MtEntry]:
+    return
+    yield
+
+
+formats: Dict[str, Tuple[Callable[[AsyncIterator[MtEntry]], AsyncIterator[str]], str]] = {
+    'json': (json_array, 'application/json'),
+    'ndjson': (ndjson, 'application/x-ndjson'),
+}
+
+
+async def stream_response(rows: AsyncIterator[MtEntry], fmt: str = 'json') -> StreamingResponse:
+    encode, mimetype = formats[fmt]
+    try:
+        rows = await started(rows)
+    except StopAsyncIteration:
+        rows = empty()
+    return StreamingResponse(encode(rows), media_type=mimetype)
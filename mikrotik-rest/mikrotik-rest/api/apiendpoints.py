@@ -1,42 +1,32 @@
-from typing import Dict, Tuple
+from typing import Dict, Tuple, Optional
+from collections import defaultdict
+from threading import Lock
 from .node import Node
-from settings import USERNAME, PASSWORD, API_TRANSPORT
-from librouteros.exceptions import ProtocolError, ConnectionClosed
-from socket import timeout
-from ssl import SSLError
+from .maintainer import maintainer
+from .results import error_codes, error_response
+from . import metrics
+from settings import USERNAME, PASSWORD, API_TRANSPORT, BROKER_SOCKET
 
 
 class Endpoint:
 
-    error_codes = {
-        ProtocolError: 400,
-        ConnectionClosed: 502,
-        timeout: 503,
-        ConnectionError: 502,
-        SSLError: 502
-    }
+    error_codes = error_codes
 
     def __init__(self, endpoint):
         self.path, self.method = Endpoint.parse(endpoint)
 
     def __call__(self, **kwargs):
         try:
-            node = Resolver.nodes_cache.get(kwargs['hostname'])
-            if not node:
-                use_ssl = API_TRANSPORT == 'SSL'
-                node = Node(kwargs['hostname'], USERNAME, PASSWORD, use_ssl)
-                Resolver.nodes_cache[kwargs['hostname']] = node
+            node = Resolver.get_node(kwargs['hostname'])
             node_method = getattr(node, self.method)
             del kwargs['hostname']
             result = node_method(path=self.path, **kwargs)
+            metrics.mark('serialize')
             return result
         except tuple(Endpoint.error_codes) as err:
-            err_type = type(err)
-            for err_supertype in err_type.mro():
-                if err_supertype in Endpoint.error_codes:
-                    return {'type': '.'.join((err_type.__module__, err_type.__name__)),
-                            'message': str(err)
-                            }, Endpoint.error_codes[err_supertype]
+            return Endpoint.error_response(err)
+
+    error_response = staticmethod(error_response)
 
     @staticmethod
     def parse(endpoint) -> Tuple[str, str]:
@@ -50,9 +40,47 @@ class Endpoint:
 class Resolver:
 
     nodes_cache: Dict[str, Node] = {}
+    nodes_locks: Dict[str, Lock] = defaultdict(Lock)
+
+    @staticmethod
+    def get_node(hostname: str, broker: Optional[str] = BROKER_SOCKET) -> Node:
+        if not broker:  # this process owns the connections
+            maintainer.start()
+        node = Resolver.nodes_cache.get(hostname)
+        if node:
+            return node
+        # concurrent first requests to a host must not log in several times
+        with Resolver.nodes_locks[hostname]:
+            node = Resolver.nodes_cache.get(hostname)
+            if not node:
+                use_ssl = API_TRANSPORT == 'SSL'
+                node = Node(hostname, USERNAME, PASSWORD, use_ssl, broker)
+                Resolver.nodes_cache[hostname] = node
+            return node
 
     def __getattr__(self, name: str) -> Endpoint:
         return Endpoint(name)
 
 
+def pool_connections() -> Dict[Tuple[str, ...], int]:
+    values = {}
+    for host, node in tuple(Resolver.nodes_cache.items()):
+        if node.pool is not None:
+            idle = len(node.pool.idle)
+            values[(host, 'open')] = node.pool.size
+            values[(host, 'busy')] = node.pool.size - idle
+            values[(host, 'idle')] = idle
+    return values
+
+
+def pool_waiters() -> Dict[Tuple[str, ...], int]:
+    return {(host,): len(node.pool.waiters)
+            for host, node in tuple(Resolver.nodes_cache.items()) if node.pool is not None}
+
+
+metrics.registry.add(metrics.Gauge(
+    'mikrotik_pool_connections', 'Pooled RouterOS API sessions by state', ('host', 'state'), pool_connections))
+metrics.registry.add(metrics.Gauge(
+    'mikrotik_pool_waiters', 'Requests waiting for a free pooled connection', ('host',), pool_waiters))
+
 api = Resolver()
@@ -0,0 +1,15 @@
+from typing import Dict, Any, List
+from .apiendpoints import Resolver, Endpoint
+from .results import operation_result
+
+
+def batch(hostname: str, body: Dict[str, Any]):
+    operations: List[Dict[str, Any]] = body['operations']
+    try:
+        node = Resolver.get_node(hostname)
+        results = node.batch(operations, body.get('stopOnError', False))
+    except tuple(Endpoint.error_codes) as err:
+        return Endpoint.error_response(err)
+    replies = [operation_result(op['method'], res) for op, res in zip(operations, results)]
+    replies += [{'skipped': True}] * (len(operations) - len(results))  # after stopOnError
+    return {'results': replies}, 200
@@ -0,0 +1,98 @@
+import asyncio
+from threading import Lock, Thread
+from time import sleep
+from typing import Callable, Dict, Tuple, TypeVar
+from librouteros.exceptions import ConnectionClosed
+from settings import CIRCUIT_FAILURES, CIRCUIT_COOLDOWN
+from . import metrics
+
+
+Conn = TypeVar('Conn')
+
+# the router could not be reached, any other error means it answered
+connect_errors = (OSError, ConnectionClosed, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of connecting to a host whose circuit is open"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Connects to one host. After `failures` consecutive connect failures the circuit opens:
+    connecting fails at once with CircuitOpenError instead of blocking for the socket timeout.
+    While it is open, a single background probe tries to connect every `cooldown` seconds,
+    and its first success closes the circuit.
+    """
+
+    def __init__(self, host: str, failures: int, cooldown: float):
+        self.host = host
+        self.failures = failures
+        self.cooldown = cooldown
+        self.lock = Lock()
+        self.failed = 0  # consecutive failed connects
+        self.is_open = False
+
+    def connect(self, factory: Callable[[], Conn], close: Callable[[Conn], None]) -> Conn:
+        self.check()
+        try:
+            conn = factory()
+        except connect_errors:
+            self.record_failure(lambda: close(factory()))
+            raise
+        self.record_success()
+        return conn
+
+    def check(self):
+        """Raise CircuitOpenError instead of connecting while the circuit is open"""
+        if self.is_open:
+            raise CircuitOpenError(f'{self.host} is unreachable after {self.failed} failed connects, '
+                                   f'retried every {self.cooldown}s')
+
+    def record_failure(self, probe: Callable[[], None]):
+        """Count a failed connect, `probe` connects and closes in the background once the circuit opens"""
+        with self.lock:
+            self.failed += 1
+            opens = self.failed >= self.failures and not self.is_open
+            self.is_open = self.is_open or opens
+        if opens:
+            Thread(target=self._probe, args=(probe,), daemon=True).start()
+
+    def record_success(self):
+        with self.lock:
+            self.failed = 0
+
+    def _probe(self, probe: Callable[[], None]):
+        while True:
+            sleep(self.cooldown)
+            try:
+                probe()
+            except connect_errors:
+                continue
+            except Exception:
+                pass  # e.g. a login trap, the router is back
+            with self.lock:
+                self.failed = 0
+                self.is_open = False
+            return
+
+
+breakers: Dict[str, CircuitBreaker] = {}
+breakers_lock = Lock()
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    """The breaker of `host`, kept for the process lifetime so it outlives failed Node creations"""
+    with breakers_lock:
+        if host not in breakers:
+            breakers[host] = CircuitBreaker(host, CIRCUIT_FAILURES, CIRCUIT_COOLDOWN)
+        return breakers[host]
+
+
+def open_circuits() -> Dict[Tuple[str, ...], int]:
+    return {(host,): int(breaker.is_open) for host, breaker in tuple(breakers.items())}
+
+
+metrics.registry.add(metrics.Gauge(
+    'mikrotik_circuit_open', '1 while requests to the host fail fast', ('host',), open_circuits))
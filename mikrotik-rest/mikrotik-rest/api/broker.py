@@ -0,0 +1,198 @@
+import json
+import os
+import socket
+import socketserver
+from contextlib import closing
+from itertools import chain
+from ssl import SSLError
+from typing import Tuple, Iterator, Iterable, Optional, Dict, Any, Type, List, Sequence
+from librouteros.exceptions import ProtocolError, TrapError, ConnectionClosed, FatalError
+from settings import BROKER_TIMEOUT
+from .connect import Where, MtEntry, Command, CommandResult
+from .pool import PoolTimeout
+from .breaker import CircuitOpenError
+from . import metrics
+from .query import QueryError
+
+
+# One JSON line per message.
+# Worker -> broker: {"host": ..., "op": "print"|"add"|"update"|"remove"|"batch"|"listen", "args": {...}}
+# Broker -> worker: {"row": {...}} for every printed entry, then {"done": result}
+#                   or {"error": {"type": ..., "message": ...}}
+# listen: {"row": {...}} for every change and {"ping": true} when idle, until the worker disconnects
+# batch result: [{"rows": [...]} or {"error": {...}} for every command]
+
+
+class BrokerError(ConnectionError):
+    """Raised when the broker is unreachable or replied with an unknown error"""
+    pass
+
+
+class ClientGone(Exception):
+    pass
+
+
+# exceptions passed from the broker to workers as is, the most specific first
+forwarded_errors: Tuple[Type[Exception], ...] = (
+    TrapError, FatalError, ProtocolError, QueryError, ConnectionClosed,
+    PoolTimeout, CircuitOpenError, socket.timeout, SSLError, ConnectionError,
+)
+errors_by_name: Dict[str, Type[Exception]] = {
+    '.'.join((err.__module__, err.__name__)): err for err in forwarded_errors
+}
+
+
+def encode_error(err: Exception) -> Dict[str, str]:
+    err_type = next(t for t in type(err).mro() if t in forwarded_errors)
+    return {'type': '.'.join((err_type.__module__, err_type.__name__)), 'message': str(err)}
+
+
+class BrokerConnectionManager:
+    """
+    ConnectionManager replacement used by workers when BROKER_SOCKET is set.
+    All RouterOS sessions are owned by the broker process,
+    so their number per host doesn't grow with the number of uwsgi workers.
+    """
+
+    def __init__(self, socket_path: str, host: str):
+        self.socket_path = socket_path
+        self.host = host
+
+    def _messages(self, op: str, **args: Any) -> Iterator[Dict[str, Any]]:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(BROKER_TIMEOUT)
+        with closing(sock):
+            try:
+                sock.connect(self.socket_path)
+            except (FileNotFoundError, ConnectionRefusedError) as err:
+                raise BrokerError(f'Broker {self.socket_path} is unreachable: {err}') from err
+            request = {'host': self.host, 'op': op, 'args': args}
+            sock.sendall(json.dumps(request).encode() + b'\n')
+            with sock.makefile('rb') as replies:
+                while True:
+                    with metrics.phase('broker'):
+                        line = replies.readline()
+                    if not line:
+                        break
+                    message = json.loads(line)
+                    if 'error' in message:
+                        raise self._error(**message['error'])
+                    yield message
+                    if 'done' in message:
+                        return
+        raise BrokerError('Broker closed the connection unexpectedly')
+
+    @staticmethod
+    def _error(type: str, message: str) -> Exception:
+        err_class = errors_by_name.get(type)
+        if err_class is None:
+            return BrokerError(f'{type}: {message}')
+        if issubclass(err_class, TrapError):
+            return err_class(message=message)
+        return err_class(message)
+
+    def _call(self, op: str, **args: Any) -> Any:
+        for message in self._messages(op, **args):
+            if 'done' in message:
+                return message['done']
+
+    def add(self, path: str, params: MtEntry) -> str:
+        return self._call('add', path=path, params=params)
+
+    def update(self, path: str, params: MtEntry):
+        self._call('update', path=path, params=params)
+
+    def remove(self, path: str, ids: Iterable[str]):
+        self._call('remove', path=path, ids=list(ids))
+
+    def apply_where(self, cmd: str, path: str, params: MtEntry, where_fields: Tuple[Where, ...]) -> int:
+        return self._call('apply_where', cmd=cmd, path=path, params=params,
+                          words=list(chain.from_iterable(where_fields)))
+
+    def batch(self, commands: Sequence[Command], stop_on_error: bool = False) -> List[CommandResult]:
+        results = self._call('batch', commands=[[cmd, list(words)] for cmd, words in commands],
+                             stop_on_error=stop_on_error)
+        return [self._error(**res['error']) if 'error' in res else tuple(res['rows'])
+                for res in results]
+
+    def listen(self, path: str) -> Iterator[Optional[MtEntry]]:
+        with closing(self._messages('listen', path=path)) as messages:
+            for message in messages:
+                yield message.get('row')
+
+    def stream(self, path: str, fields: Tuple[str, ...] = (),
+               where_fields: Tuple[Where, ...] = (), limit: Optional[int] = None) -> Iterator[MtEntry]:
+        words = list(chain.from_iterable(where_fields))
+        with closing(self._messages('print', path=path, fields=list(fields or ()),
+                                    words=words, limit=limit)) as messages:
+            for message in messages:
+                if 'row' in message:
+                    yield message['row']
+
+    def print(self, path: str, fields: Tuple[str, ...] = (),
+              where_fields: Tuple[Where, ...] = (), limit: Optional[int] = None) -> Tuple[MtEntry, ...]:
+        return tuple(self.stream(path, fields, where_fields, limit))
+
+
+class BrokerHandler(socketserver.StreamRequestHandler):
+
+    def send(self, **message: Any):
+        try:
+            self.wfile.write(json.dumps(message).encode() + b'\n')
+        except OSError as err:
+            raise ClientGone from err
+
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        try:
+            self.dispatch(request['host'], request['op'], request['args'])
+        except ClientGone:
+            pass  # the rows generator is closed, so the command is cancelled on the device
+
+    def dispatch(self, host: str, op: str, args: Dict[str, Any]):
+        from .apiendpoints import Resolver
+        try:
+            node = Resolver.get_node(host, broker=None)
+            cm = node.cm
+            if op == 'print':
+                rows = cm.stream(args['path'], tuple(args['fields']), (args['words'],), args['limit'])
+                with closing(rows):
+                    for row in rows:
+                        self.send(row=row)
+                self.send(done=None)
+            elif op in ('add', 'update', 'remove'):
+                self.send(done=getattr(cm, op)(**args))
+            elif op == 'listen':
+                changes = node.listen(args['path'])
+                with closing(changes):
+                    for row in changes:
+                        if row is None:
+                            self.send(ping=True)
+                        else:
+                            self.send(row=row)
+            elif op == 'apply_where':
+                self.send(done=cm.apply_where(args['cmd'], args['path'], args['params'], (args['words'],)))
+            elif op == 'batch':
+                results = cm.batch([(cmd, tuple(words)) for cmd, words in args['commands']],
+                                   args['stop_on_error'])
+                self.send(done=[{'error': encode_error(res)} if isinstance(res, Exception)
+                                else {'rows': res} for res in results])
+            else:
+                self.send(error={'type': 'ValueError', 'message': f'Unknown operation {op}'})
+        except forwarded_errors as err:
+            self.send(error=encode_error(err))
+
+
+class Broker(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 1024  # every uwsgi thread of every worker may connect at once
+
+
+def serve(socket_path: str):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    with Broker(socket_path, BrokerHandler) as server:
+        from .maintainer import maintainer
+        maintainer.start()
+        server.serve_forever()
+
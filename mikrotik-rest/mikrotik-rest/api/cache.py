@@ -0,0 +1,156 @@
+from collections import OrderedDict, defaultdict
+from itertools import chain
+from threading import Lock, Event
+from time import monotonic
+from typing import Tuple, Dict, Optional, Callable, Iterator, Iterable, Set, Any, List, Sequence
+from settings import CACHE_TTL, CACHE_MAX_ENTRIES
+from .connect import Where, MtEntry, Command, CommandResult
+
+
+CacheKey = Tuple[str, str, Tuple[str, ...], Tuple[str, ...], Optional[int]]  # host, path, fields, words, limit
+Rows = Tuple[MtEntry, ...]
+
+
+def related(path: str, other: str) -> bool:
+    """True if one menu contains the other, e.g. /interface and /interface/ethernet"""
+    path, other = path + '/', other + '/'
+    return path.startswith(other) or other.startswith(path)
+
+
+class Flight:
+    """Router query shared by all concurrent requests with the same key"""
+
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.done = Event()
+        self.rows: Optional[Rows] = None
+        self.error: Optional[BaseException] = None
+
+
+class ResponseCache:
+    """
+    LRU cache of printed rows with a TTL per menu path.
+    Identical concurrent misses wait for a single router query.
+    A write to a menu drops every cached query of the related menus on that host.
+    """
+
+    def __init__(self, ttls: Dict[str, float], max_entries: int):
+        self.ttls = {path.rstrip('/'): ttl for path, ttl in ttls.items()}
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.entries: 'OrderedDict[CacheKey, Tuple[float, Rows]]' = OrderedDict()  # expiry time, rows
+        self.flights: Dict[CacheKey, Flight] = {}
+        self.keys_by_host: Dict[str, Set[CacheKey]] = defaultdict(set)
+        self.generations: Dict[str, int] = defaultdict(int)  # bumped by every write to the host
+
+    def ttl(self, path: str) -> float:
+        return self.ttls.get(path.rstrip('/'), 0)
+
+    def get(self, key: CacheKey, load: Callable[[], Rows]) -> Rows:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > monotonic():
+                self.entries.move_to_end(key)
+                return entry[1]
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight(self.generations[key[0]])
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.rows
+        try:
+            flight.rows = load()
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+                # rows loaded while the host was written to may be stale already
+                if flight.rows is not None and flight.generation == self.generations[key[0]]:
+                    self._store(key, flight.rows)
+            flight.done.set()
+        return flight.rows
+
+    def _store(self, key: CacheKey, rows: Rows):
+        self.entries[key] = (monotonic() + self.ttl(key[1]), rows)
+        self.entries.move_to_end(key)
+        self.keys_by_host[key[0]].add(key)
+        while len(self.entries) > self.max_entries:
+            old_key, _ = self.entries.popitem(last=False)
+            self.keys_by_host[old_key[0]].discard(old_key)
+
+    def invalidate(self, host: str, path: str):
+        path = path.rstrip('/')
+        with self.lock:
+            for key in [k for k in self.keys_by_host[host] if related(k[1], path)]:
+                del self.entries[key]
+                self.keys_by_host[host].discard(key)
+            self.generations[host] += 1
+
+
+class CachedConnectionManager:
+    """
+    Wraps a connection manager of one host: printing menus with a TTL goes through the cache,
+    writes go through to the router and invalidate the cache.
+    """
+
+    def __init__(self, cm, host: str, cache: ResponseCache):
+        self.cm = cm
+        self.host = host
+        self.cache = cache
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.cm, name)
+
+    def add(self, path: str, params: MtEntry) -> str:
+        try:
+            return self.cm.add(path, params)
+        finally:
+            self.cache.invalidate(self.host, path)
+
+    def update(self, path: str, params: MtEntry):
+        try:
+            self.cm.update(path, params)
+        finally:
+            self.cache.invalidate(self.host, path)
+
+    def remove(self, path: str, ids: Iterable[str]):
+        try:
+            self.cm.remove(path, ids)
+        finally:
+            self.cache.invalidate(self.host, path)
+
+    def apply_where(self, cmd: str, path: str, params: MtEntry, where_fields: Tuple[Where, ...]) -> int:
+        try:
+            return self.cm.apply_where(cmd, path, params, where_fields)
+        finally:
+            self.cache.invalidate(self.host, path)
+
+    def batch(self, commands: Sequence[Command], stop_on_error: bool = False) -> List[CommandResult]:
+        try:
+            return self.cm.batch(commands, stop_on_error)
+        finally:
+            for path in {cmd.rpartition('/')[0] for cmd, _ in commands}:
+                self.cache.invalidate(self.host, path)
+
+    def print(self, path: str, fields: Tuple[str, ...] = (),
+              where_fields: Tuple[Where, ...] = (), limit: Optional[int] = None) -> Rows:
+        if not self.cache.ttl(path):
+            return self.cm.print(path, fields, where_fields, limit)
+        # compiled where words are one-shot generators, the key keeps them as a tuple
+        words = tuple(chain.from_iterable(where_fields))
+        key = (self.host, path.rstrip('/'), tuple(fields or ()), words, limit)
+        return self.cache.get(key, lambda: self.cm.print(path, fields, (words,), limit))
+
+    def stream(self, path: str, fields: Tuple[str, ...] = (),
+               where_fields: Tuple[Where, ...] = (), limit: Optional[int] = None) -> Iterator[MtEntry]:
+        if not self.cache.ttl(path):
+            return self.cm.stream(path, fields, where_fields, limit)
+        return (row for row in self.print(path, fields, where_fields, limit))
+
+
+response_cache = ResponseCache(CACHE_TTL, CACHE_MAX_ENTRIES)
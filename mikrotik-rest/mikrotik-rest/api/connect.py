@@ -1,14 +1,34 @@
-from typing import Tuple, Generator, NewType, Iterable, Dict, Any
-from itertools import count
+from typing import Tuple, Generator, NewType, Iterable, Iterator, Dict, Any, Optional, List, Union, Sequence
+from itertools import count, chain, islice
 
 import librouteros as ros
-from threading import Lock
-from expiringdict import ExpiringDict
-from settings import MAX_CONN_PER_HOST, CONN_TIMEOUT
+from librouteros.exceptions import TrapError, ConnectionClosed, FatalError
+from librouteros.protocol import parse_word, compose_word
+from threading import Lock, Thread
+from queue import Queue, Empty
+from socket import timeout, SHUT_RDWR
+from contextlib import contextmanager
+from settings import MAX_CONN_PER_HOST, CONN_TIMEOUT, POOL_ACQUIRE_TIMEOUT, IDS_PER_COMMAND
+from .pool import Pool
+from .breaker import get_breaker
+from . import metrics
 
 
 Where = NewType('Where', Generator[str, None, None])
 MtEntry = NewType('MtEntry', Dict[str, Any])
+Command = Tuple[str, Tuple[str, ...]]  # full command path and its words
+CommandResult = Union[Tuple[MtEntry, ...], TrapError]
+
+
+def parse_reply(words: Iterable[str]) -> Tuple[Optional[str], MtEntry]:
+    tag, attrs = None, {}
+    for word in words:
+        if word.startswith('.tag='):
+            tag = word[len('.tag='):]
+        elif word.startswith('='):
+            key, value = parse_word(word)
+            attrs[key] = value
+    return tag, attrs
 
 
 class Locked:
@@ -36,69 +56,358 @@ class LockedApi(Locked, ros.Api):
     def __init__(self, api):
         self.__dict__ = dict(api.__dict__)
         Locked.__init__(self)
+        self._tags = count()
+
+    def _read_tagged(self) -> Tuple[str, Optional[str], MtEntry]:
+        reply_word, words = self.protocol.readSentence()
+        return (reply_word, *parse_reply(words))
+
+    def _read_tag(self) -> Tuple[str, Optional[str]]:
+        """Reply word and tag of the next sentence, its attributes are not parsed"""
+        reply_word, words = self.protocol.readSentence()
+        return reply_word, next((word[len('.tag='):] for word in words if word.startswith('.tag=')), None)
+
+    def stream(self, cmd: str, *words: str, limit: Optional[int] = None) -> Iterator[MtEntry]:
+        """
+        Yield reply rows as soon as they arrive.
+        The command is cancelled on the router once `limit` rows were read
+        or the consumer stops iterating, so the connection stays usable.
+        """
+        tag = str(next(self._tags))
+        self.protocol.writeSentence(cmd, *words, '.tag=' + tag)
+        done, trap, rows = False, None, 0
+        try:
+            while not done and (limit is None or rows < limit):
+                reply_word, _, attrs = self._read_tagged()
+                if reply_word == '!trap':
+                    trap = TrapError(**attrs)
+                    continue
+                done = reply_word == '!done'
+                if reply_word in ('!re', '!done') and attrs:
+                    rows += 1
+                    yield attrs
+        finally:
+            if not done:
+                self._cancel(tag)
+        if trap:
+            raise trap
 
+    def pipeline(self, commands: Sequence[Command], window: int = 256) -> List[CommandResult]:
+        """
+        Write commands without waiting for their replies, so the whole list costs about one round trip.
+        At most `window` of them are in flight, so long lists can't fill the socket buffers
+        of both sides while neither is reading.
+        A trapped command doesn't stop the others, its TrapError is returned in place of rows.
+        """
+        tags = [str(next(self._tags)) for _ in commands]
+        rows: Dict[str, List[MtEntry]] = {tag: [] for tag in tags}
+        traps: Dict[str, TrapError] = {}
+        pending = set()
+        to_send = iter(zip(tags, commands))
+        sent = 0
+        while sent < len(tags) or pending:
+            for tag, (cmd, words) in islice(to_send, window - len(pending)):
+                self.protocol.writeSentence(cmd, *words, '.tag=' + tag)
+                pending.add(tag)
+                sent += 1
+            reply_word, tag, attrs = self._read_tagged()
+            if reply_word == '!trap':
+                traps[tag] = TrapError(**attrs)
+            elif reply_word in ('!re', '!done') and attrs and tag in rows:
+                rows[tag].append(attrs)
+            if reply_word == '!done':
+                pending.discard(tag)
+        return [traps.get(tag) or tuple(rows[tag]) for tag in tags]
+
+    def _cancel(self, tag: str):
+        cancel_tag = tag + '-cancel'
+        self.protocol.writeSentence('/cancel', '=tag=' + tag, '.tag=' + cancel_tag)
+        pending = {tag, cancel_tag}
+        while pending:
+            # rows still coming for the cancelled command are dropped unparsed
+            reply_word, reply_tag = self._read_tag()
+            if reply_word == '!done':
+                pending.discard(reply_tag)
+
+
+class MuxApi(ros.Api):
+    """
+    Connection shared by any number of threads at once.
+    Every command is tagged, a reader thread routes replies to the waiting callers,
+    so concurrent commands don't need a connection each.
+    """
+
+    def __init__(self, api: ros.Api, timeout: float):
+        self.__dict__ = dict(api.__dict__)
+        self.timeout = timeout
+        self.write_lock = Lock()
+        self.replies: Dict[str, Queue] = {}
+        self._tags = count()
+        self.closed = False
+        # the reader waits for replies forever, callers wait for up to `timeout`
+        self.protocol.transport.sock.settimeout(None)
+        Thread(target=self._read_replies, daemon=True).start()
+
+    def _read_replies(self):
+        try:
+            while True:
+                reply_word, words = self.protocol.readSentence()
+                tag, attrs = parse_reply(words)
+                queue = self.replies.get(tag)
+                if queue is not None:  # replies of cancelled commands are dropped
+                    queue.put((reply_word, attrs))
+        except (OSError, ConnectionClosed, FatalError) as err:
+            error = err if isinstance(err, FatalError) else ConnectionClosed(f'Connection closed: {err}')
+            self.close()
+            for queue in tuple(self.replies.values()):
+                queue.put(error)
+
+    def _write(self, cmd: str, *words: str):
+        with self.write_lock:
+            self._send(cmd, *words)
+
+    def _send(self, cmd: str, *words: str):
+        # caller holds write_lock. A failed write leaves a partial sentence, the connection is unusable
+        if self.closed:
+            raise ConnectionClosed('Connection is closed')
+        try:
+            self.protocol.writeSentence(cmd, *words)
+        except OSError as err:
+            self.close()
+            raise ConnectionClosed(f'Connection closed: {err}')
+
+    def _cancel(self, tags: Iterable[str]):
+        """Drop the replies of unfinished commands and stop them on the router, the connection stays usable"""
+        for tag in tags:
+            del self.replies[tag]
+        for tag in tags:
+            if not self.closed:
+                self._write('/cancel', '=tag=' + tag)
+
+    def _get(self, queue: Queue) -> Tuple[str, MtEntry]:
+        try:
+            reply = queue.get(timeout=self.timeout)
+        except Empty:
+            raise timeout(f'No reply within {self.timeout}s')
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    def stream(self, cmd: str, *words: str, limit: Optional[int] = None) -> Iterator[MtEntry]:
+        """Same as LockedApi.stream, but doesn't block other commands on the connection"""
+        tag = str(next(self._tags))
+        queue = self.replies[tag] = Queue()
+        done, trap, rows = False, None, 0
+        try:
+            self._write(cmd, *words, '.tag=' + tag)
+            while not done and (limit is None or rows < limit):
+                reply_word, attrs = self._get(queue)
+                if reply_word == '!trap':
+                    trap = TrapError(**attrs)
+                    continue
+                done = reply_word == '!done'
+                if reply_word in ('!re', '!done') and attrs:
+                    rows += 1
+                    yield attrs
+        finally:
+            if done:
+                del self.replies[tag]
+            else:
+                self._cancel((tag,))
+        if trap:
+            raise trap
+
+    def pipeline(self, commands: Sequence[Command]) -> List[CommandResult]:
+        """Same as LockedApi.pipeline"""
+        tags = [str(next(self._tags)) for _ in commands]
+        queues = [Queue() for _ in commands]
+        self.replies.update(zip(tags, queues))
+        results: List[CommandResult] = []
+        try:
+            with self.write_lock:
+                for tag, (cmd, words) in zip(tags, commands):
+                    self._send(cmd, *words, '.tag=' + tag)
+            for queue in queues:
+                rows, trap, done = [], None, False
+                while not done:
+                    reply_word, attrs = self._get(queue)
+                    if reply_word == '!trap':
+                        trap = TrapError(**attrs)
+                    elif reply_word in ('!re', '!done') and attrs:
+                        rows.append(attrs)
+                    done = reply_word == '!done'
+                results.append(trap or tuple(rows))
+            return results
+        finally:
+            # e.g. on a reply timeout the commands after the finished ones are still running
+            for tag in tags[:len(results)]:
+                del self.replies[tag]
+            self._cancel(tags[len(results):])
 
-def connect(host, username, password, **kwargs):
-    api = ros.connect(host, username, password, **kwargs)
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.protocol.transport.sock.shutdown(SHUT_RDWR)  # wakes up the reader
+            except OSError:
+                pass
+            self.protocol.close()
+
+
+def remember_tls_session(api: ros.Api, connect_args: Dict[str, Any]):
+    """Let the ssl_wrapper resume the session of this connection, see node.TlsSessionWrapper"""
+    remember = getattr(connect_args.get('ssl_wrapper'), 'remember', None)
+    if remember is not None:
+        remember(api.protocol.transport.sock)
+
+
+def connect(host, username, password, read_timeout=None, **kwargs):
+    # `timeout` limits connecting and login, `read_timeout` every reply afterwards
+    with metrics.phase('connect'):
+        api = ros.connect(host, username, password, **kwargs)
+    metrics.connections_opened.inc(host)
+    remember_tls_session(api, kwargs)
+    if read_timeout is not None:
+        api.protocol.transport.sock.settimeout(read_timeout)
     lapi = LockedApi(api)
     return lapi
 
 
+def connect_mux(host, username, password, read_timeout=None, **kwargs):
+    with metrics.phase('connect'):
+        api = ros.connect(host, username, password, **kwargs)
+    metrics.connections_opened.inc(host)
+    remember_tls_session(api, kwargs)
+    return MuxApi(api, read_timeout or kwargs.get('timeout', ros.DEFAULTS['timeout']))
+
+
 class ConnectionManager:
 
     def __init__(self, **connect_args):
         self.connect_args = connect_args
-        self._cnt = count()
-        api = connect(**connect_args)
-        self.connections = ExpiringDict(max_len=MAX_CONN_PER_HOST,
-                                        max_age_seconds=CONN_TIMEOUT,
-                                        items={self._id: api})
-
-    @property
-    def _id(self) -> int:
-        return next(self._cnt)
-
-    def _acquire_api(self):
-        with self.connections.lock:
-            for api in self.connections.values():
-                if not api.locked():
-                    api.acquire()
-                    free_api = api
-                    break
-            else:
-                free_api = connect(**self.connect_args)
-                free_api.acquire()
-                self.connections[self._id] = free_api
-            return free_api
-
-    def _cur(self, op: str, path: str, *remove_params: Tuple[str, ...], **params: MtEntry):
-        api = self._acquire_api()
-        # TODO: add exceptions handling
+        self.breaker = get_breaker(connect_args['host'])
+        self.pool = Pool(factory=lambda: self.breaker.connect(self._connect, self._close),
+                         close=self._close,
+                         max_size=MAX_CONN_PER_HOST,
+                         idle_timeout=CONN_TIMEOUT,
+                         acquire_timeout=POOL_ACQUIRE_TIMEOUT,
+                         name=connect_args['host'])
+        self.pool.release(self.pool.acquire())
+
+    def _connect(self) -> LockedApi:
+        return connect(**self.connect_args)
+
+    def _close(self, api: LockedApi):
+        metrics.connections_closed.inc(self.connect_args['host'])
+        api.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[LockedApi]:
+        with metrics.phase('pool'):
+            api = self.pool.acquire()
         try:
-            method = getattr(api.path(path), op)
-            return method(*remove_params, **params)
-        finally:
-            api.release()
+            with metrics.phase('router'):
+                yield api
+        except (OSError, ConnectionClosed, FatalError):
+            # reply stream is out of sync, the connection can't be reused
+            self.pool.discard(api)
+            raise
+        except BaseException:
+            self.pool.release(api)
+            raise
+        self.pool.release(api)
+
+    def _cur(self, cmd: str, path: str, *words: str) -> Tuple[MtEntry, ...]:
+        with self.connection() as api:
+            return tuple(api.stream(path.rstrip('/') + '/' + cmd, *words))
 
     def add(self, path: str, params: MtEntry) -> str:
-        return self._cur('add', path, **params)
+        rows = self._cur('add', path, *(compose_word(k, v) for k, v in params.items()))
+        return rows[0]['ret']
 
     def update(self, path: str, params: MtEntry):
-        self._cur('update', path, **params)
+        self._cur('set', path, *(compose_word(k, v) for k, v in params.items()))
 
     def remove(self, path: str, ids: Iterable[str]):
-        self._cur('remove', path, *ids)
+        self._cur('remove', path, compose_word('.id', ','.join(ids)))
+
+    def apply_where(self, cmd: str, path: str, params: MtEntry, where_fields: Tuple[Where, ...]) -> int:
+        """
+        Run `cmd` (set or remove) on the entries matching the filter, found on the same connection.
+        Ids are joined by commas, IDS_PER_COMMAND per command. Returns the number of matched entries
+        """
+        path = path.rstrip('/')
+        words = tuple(compose_word(k, v) for k, v in params.items())
+        with self.connection() as api:
+            ids = [row['.id'] for row in api.stream(path + '/print', '=.proplist=.id',
+                                                    *chain.from_iterable(where_fields))]
+            chunks = [ids[i:i + IDS_PER_COMMAND] for i in range(0, len(ids), IDS_PER_COMMAND)]
+            results = api.pipeline([(path + '/' + cmd, words + (compose_word('.id', ','.join(chunk)),))
+                                    for chunk in chunks])
+        for result in results:
+            if isinstance(result, TrapError):
+                raise result
+        return len(ids)
+
+    def batch(self, commands: Sequence[Command], stop_on_error: bool = False) -> List[CommandResult]:
+        """
+        Run commands in order on one connection.
+        With `stop_on_error` every command waits for the previous reply and the rest
+        are skipped after the first trap, otherwise they are pipelined.
+        """
+        with self.connection() as api:
+            if not stop_on_error:
+                return api.pipeline(commands)
+            results: List[CommandResult] = []
+            for cmd, words in commands:
+                try:
+                    results.append(tuple(api.stream(cmd, *words)))
+                except TrapError as err:
+                    results.append(err)
+                    break
+            return results
+
+    def stream(self, path: str, fields: Tuple[str, ...] = (),
+               where_fields: Tuple[Where, ...] = (), limit: Optional[int] = None) -> Iterator[MtEntry]:
+        words = []
+        if fields:
+            words.append('=.proplist=' + ','.join(fields))
+        words.extend(chain.from_iterable(where_fields))
+        with self.connection() as api:
+            yield from api.stream(path.rstrip('/') + '/print', *words, limit=limit)
 
     def print(self, path: str, fields: Tuple[str, ...] = (),
-              where_fields: Tuple[Where, ...] = (), limit: int = 10 ** 10) -> Tuple[MtEntry, ...]:
-        api = self._acquire_api()
+              where_fields: Tuple[Where, ...] = (), limit: Optional[int] = None) -> Tuple[MtEntry, ...]:
+        return tuple(self.stream(path, fields, where_fields, limit))
+
+
+class MuxConnectionManager(ConnectionManager):
+    """
+    ConnectionManager with a single MuxApi connection per host (API_MULTIPLEX = True).
+    All threads share it, so high fan-in to one router costs one session.
+    """
+
+    def __init__(self, **connect_args):
+        self.connect_args = connect_args
+        self.breaker = get_breaker(connect_args['host'])
+        self.lock = Lock()
+        self.api = self.breaker.connect(self._connect, self._close)
+
+    def _connect(self) -> MuxApi:
+        return connect_mux(**self.connect_args)
+
+    @contextmanager
+    def connection(self) -> Iterator[MuxApi]:
+        if self.api.closed:
+            with self.lock:
+                if self.api.closed:
+                    self.api = self.breaker.connect(self._connect, self._close)
+        api = self.api
         try:
-            query = api.path(path)
-            if fields:
-                query = query.select(*fields)
-            if where_fields:
-                query = query.where(*where_fields)
-            c = count()
-            return tuple(i for i in query if next(c) < limit)
-        finally:
-            api.release()
+            with metrics.phase('router'):
+                yield api
+        except (ConnectionClosed, FatalError):
+            # a reply timeout is not caught here, MuxApi cancels just the late command.
+            # Read and write errors close the connection inside MuxApi and surface as ConnectionClosed
+            self._close(api)  # reopened by the next command
+            raise
@@ -0,0 +1,99 @@
+from concurrent.futures import Executor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from functools import partial
+from itertools import islice
+from threading import Event
+from time import monotonic
+from typing import Dict, Any, Iterator, List, Callable, Optional
+from settings import FANOUT_CONCURRENCY, FANOUT_HOST_TIMEOUT, FANOUT_WORKERS
+from .apiendpoints import Resolver, Endpoint
+from .node import Node
+from .streaming import ndjson, chunked_response
+
+
+# shared by all requests, so concurrent ones can't open more than FANOUT_WORKERS router connections
+fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS)
+
+
+def query_host(host: str, cancelled: Event, query: Dict[str, Any]) -> Dict[str, Any]:
+    # a print changes nothing, it is left to finish on its socket timeout when cancelled
+    node = Resolver.get_node(host)
+    fields, where_fields = Node.prepare_query(query.get('limit'), query.get('fields'),
+                                              query.get('where'), query.get('any'))
+    return {'host': host,
+            'reply': node.cm.print(query['path'], fields, where_fields, query.get('limit'))}
+
+
+def error_entry(host: str, code: int, message: str) -> Dict[str, Any]:
+    return {'host': host, 'error': True, 'errorCode': code, 'errorMessage': message}
+
+
+def host_results(hosts: List[str], task: Callable[[str, Event], Dict[str, Any]],
+                 executor: Executor, timeout: float,
+                 concurrency: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Run `task` for every host on `executor`, yield every host result as soon as it is ready,
+    in completion order. A host gets `timeout` seconds from the moment its task starts.
+    At most `concurrency` hosts are submitted at once, the next one when a result is yielded.
+    The event passed to the task is set once its result is dropped: the host timed out,
+    or the caller stopped reading
+    """
+    started: Dict[str, float] = {}
+    cancelled = {host: Event() for host in hosts}
+    waiting = iter(hosts)
+    futures: Dict[Future, str] = {}
+    pending = set()
+
+    def run(host: str) -> Dict[str, Any]:
+        started[host] = monotonic()
+        return task(host, cancelled[host])
+
+    def submit(count: Optional[int]):
+        for host in islice(waiting, count):
+            future = executor.submit(run, host)
+            futures[future] = host
+            pending.add(future)
+
+    submit(concurrency)
+    try:
+        while pending:
+            running = [started[futures[f]] for f in pending if futures[f] in started]
+            next_deadline = min(running) + timeout - monotonic() if running else timeout
+            done, _ = wait(pending, timeout=max(next_deadline, 0), return_when=FIRST_COMPLETED)
+            pending -= done
+            for future in done:
+                host = futures[future]
+                try:
+                    yield future.result()
+                except tuple(Endpoint.error_codes) as err:
+                    body, code = Endpoint.error_response(err)
+                    yield error_entry(host, code, body['message'])
+                except Exception as err:
+                    yield error_entry(host, 500, f'{type(err).__name__}: {err}')
+            now = monotonic()
+            for future in [f for f in pending if now - started.get(futures[f], now) >= timeout]:
+                # the worker thread finishes on its socket timeout, its result is dropped
+                cancelled[futures[future]].set()
+                pending.discard(future)
+                yield error_entry(futures[future], 504, f'No reply within {timeout}s')
+            if concurrency:
+                submit(concurrency - len(pending))
+    finally:
+        for future in pending:
+            cancelled[futures[future]].set()
+            future.cancel()
+
+
+def fan_out_results(hosts: List[str], query: Dict[str, Any],
+                    concurrency: int, timeout: float) -> Iterator[Dict[str, Any]]:
+    return host_results(hosts, partial(query_host, query=query), fanout_executor, timeout,
+                        min(concurrency, FANOUT_WORKERS))
+
+
+def fan_out(body):
+    hosts = list(dict.fromkeys(body.pop('hosts')))  # deduplicated, order kept
+    concurrency = body.pop('concurrency', FANOUT_CONCURRENCY)
+    timeout = body.pop('timeout', FANOUT_HOST_TIMEOUT)
+    if not hosts:
+        return [], 200
+    return chunked_response(ndjson(fan_out_results(hosts, body, concurrency, timeout)),
+                            'application/x-ndjson')
@@ -0,0 +1,166 @@
+from collections import defaultdict
+from importlib.metadata import version
+from threading import Lock
+from typing import Dict, Tuple, Optional, Callable, Iterable
+import flask
+from connexion.apis.flask_api import FlaskApi
+from connexion.operations import make_operation
+from connexion.options import ConnexionOptions
+from connexion.resolver import Resolver
+from connexion.spec import Specification, OpenAPISpecification
+from connexion.utils import deep_get
+from settings import SPEC_FILES, SPEC_IDLE_TIMEOUT
+from .specloader import CompiledSpec
+from . import metrics
+
+
+METHODS = ('get', 'put', 'post', 'delete', 'patch', 'head', 'options', 'trace')
+
+# LazyFlaskApi is built on connexion internals (AbstractAPI.__init__, make_operation),
+# so it refuses to run on any other release than the one pinned in requirements.txt
+CONNEXION_VERSION = '2.7.0'
+if version('connexion') != CONNEXION_VERSION:
+    raise ImportError(f'LazyFlaskApi requires connexion=={CONNEXION_VERSION}, '
+                      f'found {version("connexion")}. Serve asgi.py for connexion 3')
+
+class CompiledSpecification(OpenAPISpecification):
+    """Specification of a CompiledSpec, which was validated when it was compiled"""
+
+    @classmethod
+    def _validate_spec(cls, spec):
+        pass
+
+
+def load_specification(specification, arguments=None) -> Specification:
+    """Specification.load, which doesn't validate a CompiledSpec again"""
+    if isinstance(specification, CompiledSpec):
+        return CompiledSpecification(specification)
+    return Specification.load(specification, arguments=arguments)
+
+
+class Routes:
+    """
+    Matches request paths to spec paths.
+    Spec paths are grouped by the positions of their {parameters},
+    so a lookup is one dict access per group instead of trying every path.
+    """
+
+    def __init__(self, paths: Iterable[str]):
+        self.groups: Dict[Tuple[int, ...], Dict[Tuple[str, ...], str]] = defaultdict(dict)
+        self.static_heads = set()  # first segments which are not parameters
+        for path in paths:
+            segments = self.split(path)
+            params = tuple(i for i, segment in enumerate(segments) if segment.startswith('{'))
+            self.groups[params][self.key(segments, params)] = path
+            if 0 not in params:
+                self.static_heads.add(segments[0])
+        # static paths win over parametrized ones, as with werkzeug rules
+        self.groups = dict(sorted(self.groups.items(), key=lambda group: len(group[0])))
+
+    @staticmethod
+    def split(path: str) -> Tuple[str, ...]:
+        return tuple(path.strip('/').split('/'))
+
+    @staticmethod
+    def key(segments: Tuple[str, ...], params: Tuple[int, ...]) -> Tuple[str, ...]:
+        return tuple('' if i in params else segment for i, segment in enumerate(segments))
+
+    def match(self, path: str) -> Optional[Tuple[str, Dict[str, str]]]:
+        segments = self.split(path)
+        for params, paths in self.groups.items():
+            if params and params[-1] >= len(segments):
+                continue
+            spec_path = paths.get(self.key(segments, params))
+            if spec_path is not None:
+                names = self.split(spec_path)
+                return spec_path, {names[i][1:-1].replace('-', '_'): segments[i] for i in params}
+        return None
+
+
+class Operations:
+    """Routes of one spec and its operations built so far"""
+
+    def __init__(self, api: FlaskApi, specification):
+        self.api = api
+        self.specification = specification
+        self.routes = Routes(specification.get('paths', {}))
+        self.functions: Dict[Tuple[str, str], Callable] = {}
+        self.lock = Lock()
+
+    def get(self, path: str, method: str) -> Callable:
+        function = self.functions.get((path, method))
+        if function is not None:
+            return function
+        if method not in deep_get(self.specification, ['paths', path]):
+            flask.abort(405)
+        api = self.api
+        with self.lock:
+            if (path, method) not in self.functions:
+                operation = make_operation(
+                    self.specification, api, path, method, api.resolver,
+                    validate_responses=api.validate_responses,
+                    validator_map=api.validator_map,
+                    strict_validation=api.strict_validation,
+                    pythonic_params=api.pythonic_params,
+                    uri_parser_class=api.options.uri_parser_class,
+                    pass_context_arg_name=api.pass_context_arg_name)
+                self.functions[path, method] = operation.function
+            return self.functions[path, method]
+
+
+class LazyFlaskApi(FlaskApi):
+    """
+    FlaskApi which builds an operation (handler, validators) on its first request.
+    All spec paths are served by one url rule, so ~1000 werkzeug rules
+    aren't compiled on every worker boot. Path parameters are passed as strings.
+    With SPEC_FILES set, requests to a host are served by the spec of its RouterOS version.
+    """
+
+    def __init__(self, specification, base_path=None, arguments=None,
+                 validate_responses=False, strict_validation=False, resolver=None,
+                 auth_all_paths=False, debug=False, resolver_error_handler=None,
+                 validator_map=None, pythonic_params=False, pass_context_arg_name=None, options=None):
+        # AbstractAPI.__init__ of connexion 2.7, with the specification from load_specification
+        self.debug = debug
+        self.validator_map = validator_map
+        self.resolver_error_handler = resolver_error_handler
+        self.specification = load_specification(specification, arguments)
+        self.options = ConnexionOptions(options, oas_version=self.specification.version)
+        self._set_base_path(base_path)
+        self.resolver = resolver or Resolver()
+        self.validate_responses = validate_responses
+        self.strict_validation = strict_validation
+        self.pythonic_params = pythonic_params
+        self.pass_context_arg_name = pass_context_arg_name
+        if self.options.openapi_spec_available:
+            self.add_openapi_json()
+            self.add_openapi_yaml()
+        if self.options.openapi_console_ui_available:
+            self.add_swagger_ui()
+        self.add_paths()
+        if auth_all_paths:
+            self.add_auth_on_not_found(self.specification.security, self.specification.security_definitions)
+
+    def add_paths(self, paths=None):
+        from .specregistry import SpecRegistry
+        self.operations = Operations(self, self.specification)
+        self.registry = SpecRegistry(self, SPEC_FILES, SPEC_IDLE_TIMEOUT) if SPEC_FILES else None
+        self.blueprint.add_url_rule('/<path:request_path>', 'lazy_operations', self.dispatch,
+                                    methods=[method.upper() for method in METHODS])
+
+    def operations_for(self, request_path: str) -> Operations:
+        if self.registry is None:
+            return self.operations
+        head = request_path.split('/', 1)[0]
+        if head in self.operations.routes.static_heads:  # /runTemplate, /fanOut
+            return self.operations
+        return self.registry.for_host(head) or self.operations
+
+    def dispatch(self, request_path: str):
+        operations = self.operations_for(request_path)
+        match = operations.routes.match(request_path)
+        if match is None:
+            flask.abort(404)
+        path, path_params = match
+        metrics.set_host(path_params.get('hostname'))
+        return operations.get(path, flask.request.method.lower())(**path_params)
@@ -0,0 +1,182 @@
+from collections import deque
+from contextlib import contextmanager
+from socket import SHUT_RDWR
+from threading import Lock, Condition, Thread
+from time import monotonic
+from typing import Dict, Tuple, Iterator, Optional, Any, Deque, Set
+from librouteros.exceptions import TrapError, ConnectionClosed, FatalError
+from settings import LISTEN_HEARTBEAT, LISTEN_QUEUE_SIZE
+from .connect import connect, LockedApi, MtEntry
+from .breaker import get_breaker
+
+
+END = object()  # no more changes for the subscriber
+
+
+class SlowConsumer(ConnectionError):
+    """Raised to a subscriber which fell LISTEN_QUEUE_SIZE changes behind"""
+    pass
+
+
+class Subscriber:
+    """Changes pending for one client, filled by the listen thread"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.changes: Deque[MtEntry] = deque()
+        self.ready = Condition()
+        self.error: Optional[Exception] = None
+        self.ended = False
+
+    def put(self, row: MtEntry):
+        with self.ready:
+            if len(self.changes) >= self.max_size:
+                self.end(SlowConsumer(f'Client fell {self.max_size} changes behind'))
+                return
+            self.changes.append(row)
+            self.ready.notify()
+
+    def end(self, error: Optional[Exception] = None):
+        with self.ready:
+            self.ended = True
+            self.error = self.error or error
+            if error:
+                self.changes.clear()
+            self.ready.notify()
+
+    def get(self, timeout: float) -> Any:
+        """Next change, None if nothing changed within `timeout`, END after the last one"""
+        deadline = monotonic() + timeout
+        with self.ready:
+            while not self.changes and not self.ended:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return None
+                self.ready.wait(remaining)
+            if self.changes:
+                return self.changes.popleft()
+            if self.error:
+                raise self.error
+            return END
+
+
+class Subscription:
+    """
+    One `listen` command on a dedicated connection,
+    its changes are copied to every subscriber.
+    """
+
+    def __init__(self, connect_args: Dict[str, Any], path: str):
+        self.path = path
+        self.subscribers: Set[Subscriber] = set()
+        self.closed = False  # set by Subscriptions, no new subscribers after it
+        self.error: Optional[Exception] = None
+        self.api: LockedApi = get_breaker(connect_args['host']).connect(
+            lambda: connect(**connect_args), LockedApi.close)
+        # changes may not come for hours, the listen command must not time out
+        self.api.protocol.transport.sock.settimeout(None)
+        Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        error = None
+        try:
+            for row in self.api.stream(self.path + '/listen'):
+                for subscriber in tuple(self.subscribers):
+                    subscriber.put(row)
+            error = ConnectionClosed(f'{self.path}/listen finished unexpectedly')
+        except (OSError, ConnectionClosed, FatalError, TrapError) as err:
+            error = err
+        finally:
+            self.error = error
+            for subscriber in subscriptions.forget(self):
+                subscriber.end(error)
+
+    def close(self):
+        try:
+            self.api.protocol.transport.sock.shutdown(SHUT_RDWR)  # wakes up the listen thread
+            self.api.close()
+        except OSError:
+            pass
+
+
+class Subscriptions:
+    """Active subscriptions, one per host and menu"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.active: Dict[Tuple[str, str], Subscription] = {}
+        # lock and the number of threads using it, dropped when it is not used anymore
+        self.connect_locks: Dict[Tuple[str, str], Tuple[Lock, int]] = {}
+
+    @contextmanager
+    def _connect_lock(self, key: Tuple[str, str]) -> Iterator[None]:
+        with self.lock:
+            lock, users = self.connect_locks.get(key, (None, 0))
+            lock = lock or Lock()
+            self.connect_locks[key] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self.lock:
+                lock, users = self.connect_locks[key]
+                if users == 1:
+                    del self.connect_locks[key]
+                else:
+                    self.connect_locks[key] = (lock, users - 1)
+
+    def subscribe(self, connect_args: Dict[str, Any], path: str) -> Iterator[Optional[MtEntry]]:
+        """
+        Yield every changed (or removed, with .dead) entry of the menu.
+        None is yielded right after subscribing and then every LISTEN_HEARTBEAT seconds
+        without changes, so the caller can check its client is still there.
+        """
+        path = path.rstrip('/')
+        key = (connect_args['host'], path)
+        subscriber = Subscriber(LISTEN_QUEUE_SIZE)
+        # concurrent first subscribers must not start several listen commands
+        with self._connect_lock(key):
+            with self.lock:
+                subscription = self.active.get(key)
+                if subscription is not None:
+                    subscription.subscribers.add(subscriber)
+                    return self._changes(key, subscription, subscriber)
+            subscription = Subscription(connect_args, path)
+            with self.lock:
+                subscription.subscribers.add(subscriber)
+                if subscription.closed:  # failed right away
+                    subscriber.end(subscription.error)
+                else:
+                    self.active[key] = subscription
+        return self._changes(key, subscription, subscriber)
+
+    def _changes(self, key: Tuple[str, str], subscription: Subscription,
+                 subscriber: Subscriber) -> Iterator[Optional[MtEntry]]:
+        try:
+            yield None
+            while True:
+                change = subscriber.get(LISTEN_HEARTBEAT)
+                if change is END:
+                    return
+                yield change
+        finally:
+            with self.lock:
+                subscription.subscribers.discard(subscriber)
+                last = not subscription.subscribers and not subscription.closed
+                if last:
+                    subscription.closed = True
+                    del self.active[key]
+            if last:
+                subscription.close()
+
+    def forget(self, subscription: Subscription) -> Tuple[Subscriber, ...]:
+        """Drop a finished subscription, return the subscribers to notify"""
+        with self.lock:
+            subscription.closed = True
+            for key, active in tuple(self.active.items()):
+                if active is subscription:
+                    del self.active[key]
+            return tuple(subscription.subscribers)
+
+
+subscriptions = Subscriptions()
@@ -0,0 +1,60 @@
+import json
+from contextlib import closing
+from threading import BoundedSemaphore
+from typing import Iterator, Optional
+from settings import LISTEN_MAX_CLIENTS
+from .apiendpoints import Resolver, Endpoint
+from .connect import MtEntry
+from .streaming import started, chunked_response
+
+
+# under uwsgi every connected client holds a worker thread
+client_slots = BoundedSemaphore(LISTEN_MAX_CLIENTS)
+
+
+def sse(changes: Iterator[Optional[MtEntry]]) -> Iterator[str]:
+    with closing(changes):
+        try:
+            for row in changes:
+                # comments keep idle connections open and detect gone clients
+                yield ': ping\n\n' if row is None else f'data: {json.dumps(row)}\n\n'
+        except tuple(Endpoint.error_codes) as err:
+            error, code = Endpoint.error_response(err)
+            yield f'event: error\ndata: {json.dumps(dict(error, code=code))}\n\n'
+
+
+class EventStream:
+    """SSE body holding one of the client slots until it ends or the client goes away"""
+
+    def __init__(self, changes: Iterator[Optional[MtEntry]]):
+        self.events = sse(changes)
+        self.released = False
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            yield from self.events
+        finally:
+            self.close()
+
+    def close(self):
+        self.events.close()
+        if not self.released:
+            self.released = True
+            client_slots.release()
+
+
+def subscribe(hostname: str, path: str):
+    if not client_slots.acquire(blocking=False):
+        return {'type': 'TooManyClients',
+                'message': f'All {LISTEN_MAX_CLIENTS} subscriber slots of this worker are taken'}, 503
+    try:
+        node = Resolver.get_node(hostname)
+        changes = started(node.listen(path))
+    except tuple(Endpoint.error_codes) as err:
+        client_slots.release()
+        return Endpoint.error_response(err)
+    except BaseException:
+        client_slots.release()
+        raise
+    return chunked_response(EventStream(changes), 'text/event-stream',
+                            {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
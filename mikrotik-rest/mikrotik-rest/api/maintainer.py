@@ -0,0 +1,83 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from time import monotonic, sleep
+from typing import Iterable, List
+from librouteros.exceptions import ConnectionClosed, FatalError, TrapError
+from settings import HOT_HOSTS, HOT_HOST_WINDOW, POOL_MIN_IDLE, KEEPALIVE_INTERVAL, KEEPALIVE_WORKERS
+from .connect import LockedApi
+from .pool import Pool
+
+
+def ping(api: LockedApi) -> bool:
+    """A cheap command, False if the connection is broken"""
+    try:
+        tuple(api.stream('/system/identity/print'))
+        return True
+    except TrapError:
+        return True  # the router answered
+    except (OSError, ConnectionClosed, FatalError):
+        return False
+
+
+class Maintainer:
+    """
+    Background thread keeping the connection pools of hot hosts warm, so their requests
+    don't pay TCP, TLS and login. Hot are `hosts`, and the hosts requested within the last `window` seconds.
+    Every `interval` seconds each of them gets `min_idle` idle connections, opened ahead of requests
+    if needed, and a cheap command is sent on them so they never reach CONN_TIMEOUT.
+    The idle connections of every other host are closed once they reach CONN_TIMEOUT,
+    rather than on the next request to that host, which may never come.
+    """
+
+    def __init__(self, hosts: Iterable[str], window: float, min_idle: int, interval: float, workers: int):
+        self.hosts = tuple(hosts)
+        self.window = window
+        self.min_idle = min_idle
+        self.interval = interval
+        self.workers = workers
+        self.lock = Lock()
+        self.thread = None
+
+    def start(self):
+        # started on first use rather than at import, so it survives forking workers
+        if not self.interval:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        with ThreadPoolExecutor(self.workers) as executor:
+            while True:
+                started = monotonic()
+                list(executor.map(self.warm_host, self.hot_hosts()))
+                self.evict_idle()
+                sleep(max(self.interval - (monotonic() - started), 0))
+
+    def hot_hosts(self) -> List[str]:
+        from .apiendpoints import Resolver
+        now = monotonic()
+        learned = [host for host, node in tuple(Resolver.nodes_cache.items())
+                   if node.pool is not None and now - node.pool.last_used < self.window]
+        return list(dict.fromkeys(self.hosts + tuple(learned)))
+
+    @staticmethod
+    def evict_idle():
+        from .apiendpoints import Resolver
+        for node in tuple(Resolver.nodes_cache.values()):
+            if node.pool is not None:
+                node.pool.evict_idle()
+
+    def warm_host(self, host: str):
+        from .apiendpoints import Endpoint, Resolver
+        try:
+            # configured hosts are connected to before their first request
+            pool: Pool = Resolver.get_node(host, broker=None).pool
+            if pool is not None:
+                pool.keep_warm(self.min_idle, ping)
+        except tuple(Endpoint.error_codes):
+            pass  # retried next round, repeated connect failures open the host's circuit
+
+
+maintainer = Maintainer(HOT_HOSTS, HOT_HOST_WINDOW, POOL_MIN_IDLE, KEEPALIVE_INTERVAL, KEEPALIVE_WORKERS)
@@ -0,0 +1,261 @@
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+from typing import Dict, Tuple, List, Callable, Iterator, Optional
+from flask import Flask, Response
+
+
+LabelValues = Tuple[str, ...]
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = Lock()
+
+    def label_str(self, values: LabelValues, extra: str = '') -> str:
+        pairs = ['{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                 for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} {self.kind}'
+        yield from self.samples()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = defaultdict(float)
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self.lock:
+            self.values[label_values] += amount
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = tuple(self.values.items())
+        for label_values, value in values:
+            yield f'{self.name}{self.label_str(label_values)} {value}'
+
+
+class Gauge(Metric):
+    """Values collected on every scrape"""
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...],
+                 collect: Callable[[], Dict[LabelValues, float]]):
+        super().__init__(name, help, labels)
+        self.collect = collect
+
+    def samples(self) -> Iterator[str]:
+        for label_values, value in self.collect().items():
+            yield f'{self.name}{self.label_str(label_values)} {value}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # per label values: count in every bucket (not cumulative), the last one is +Inf, and the sum
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self.lock:
+            counts, total = self.values.setdefault(label_values, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+
+    def samples(self) -> Iterator[str]:
+        with self.lock:
+            values = [(label_values, list(counts), total[0])
+                      for label_values, (counts, total) in self.values.items()]
+        for label_values, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = 'le="{}"'.format(bound)
+                yield f'{self.name}_bucket{self.label_str(label_values, le)} {cumulative}'
+            yield f'{self.name}_sum{self.label_str(label_values)} {total}'
+            yield f'{self.name}_count{self.label_str(label_values)} {cumulative}'
+
+
+class Registry:
+    """
+    Metrics of this process. A scrape reaches a single uwsgi worker, so each scrape target
+    must run one worker (processes = 1 in uwsgi.ini), see README
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.add(Histogram(
+    'mikrotik_request_duration_seconds', 'Requests served, by router', ('host',)))
+phase_duration = registry.add(Histogram(
+    'mikrotik_request_phase_seconds', 'Time spent by requests in every phase, by router', ('host', 'phase')))
+pool_wait = registry.add(Histogram(
+    'mikrotik_pool_wait_seconds', 'Time waited for a free pooled connection', ('host',)))
+connections_opened = registry.add(Counter(
+    'mikrotik_connections_opened_total', 'RouterOS API sessions opened', ('host',)))
+connections_closed = registry.add(Counter(
+    'mikrotik_connections_closed_total', 'RouterOS API sessions closed', ('host',)))
+errors = registry.add(Counter(
+    'mikrotik_errors_total', 'Errors returned to clients, by class', ('type', 'code')))
+
+
+class Timings:
+    """
+    Durations of the phases of one request. Time spent in a phase nested in another one,
+    e.g. login while acquiring a pooled connection, is counted for the nested phase only
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.host: Optional[str] = None
+        self.phases: Dict[str, float] = defaultdict(float)
+        self.nested: List[float] = []  # time of the phases nested in the running ones
+        self.marks: Dict[str, float] = {}  # phases lasting until the response is sent
+
+    def server_timing(self) -> str:
+        entries = [f'{name};dur={duration * 1000:.2f}' for name, duration in self.phases.items()]
+        entries.append(f'total;dur={(perf_counter() - self.started) * 1000:.2f}')
+        return ', '.join(entries)
+
+
+# Timings of the request being served. A context variable rather than a thread local,
+# so under asgi.py it follows the request across the event loop and the thread pool
+timings: ContextVar[Optional[Timings]] = ContextVar('timings', default=None)
+
+
+def current_timings() -> Optional[Timings]:
+    return timings.get()
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Count the time of the block for `name`, outside of a request it is not recorded"""
+    current = current_timings()
+    if current is None:
+        yield
+        return
+    started = perf_counter()
+    current.nested.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = perf_counter() - started
+        current.phases[name] += elapsed - current.nested.pop()
+        if current.nested:
+            current.nested[-1] += elapsed
+
+
+def mark(name: str):
+    """Start `name` phase lasting until the response is sent, e.g. serialization of the handler result"""
+    current = current_timings()
+    if current is not None:
+        current.marks[name] = perf_counter()
+
+
+def set_host(host: Optional[str]):
+    """Router the request is about, its timings are observed in the per-host histograms"""
+    current = current_timings()
+    if current is not None:
+        current.host = host
+
+
+def start_request():
+    timings.set(Timings())
+
+
+def observe(current: Timings) -> str:
+    """End the marked phases, record the request in the histograms, returns its Server-Timing header"""
+    now = perf_counter()
+    for name, started in current.marks.items():
+        current.phases[name] += now - started
+    if current.host:
+        request_duration.observe(now - current.started, current.host)
+        for name, duration in current.phases.items():
+            phase_duration.observe(duration, current.host, name)
+    return current.server_timing()
+
+
+def finish_request(response: Response) -> Response:
+    current = current_timings()
+    if current is None:
+        return response
+    timings.set(None)
+    response.headers['Server-Timing'] = observe(current)
+    return response
+
+
+content_type = 'text/plain; version=0.0.4'
+
+
+def metrics_view() -> Response:
+    return Response(registry.render(), mimetype=content_type)
+
+
+def init_app(app: Flask):
+    """Time the phases of every request and serve /metrics"""
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+class MetricsMiddleware:
+    """ASGI counterpart of init_app, for asgi.py: times every request and serves /metrics"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        if scope['path'] == '/metrics':
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', content_type.encode())]})
+            await send({'type': 'http.response.body', 'body': registry.render().encode()})
+            return
+        current = Timings()
+        token = timings.set(current)
+
+        async def send_timed(message):
+            if message['type'] == 'http.response.start':
+                headers = [*message.get('headers', ()), (b'server-timing', observe(current).encode())]
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            timings.reset(token)
@@ -0,0 +1,193 @@
+import logging
+import sys
+from contextlib import closing
+from itertools import chain, islice
+from threading import Lock, Thread
+from time import sleep
+from typing import Tuple, Dict, List, Optional, Iterator, Iterable, Any, Callable
+from librouteros.protocol import parse_word
+from settings import MIRROR_RESYNC_DELAY
+from .connect import Where, MtEntry
+from .listen import subscriptions
+
+
+log = logging.getLogger(__name__)
+
+MISSING = object()  # property absent from the entry
+Packed = Tuple[Any, ...]
+
+
+class UnsupportedQuery(Exception):
+    """Query word the mirror can't evaluate, the router has to answer it"""
+    pass
+
+
+def typed(key: str, value: str) -> Any:
+    if key == '.id':
+        try:
+            return int(value.lstrip('*'), 16)  # ids are ordered as numbers
+        except ValueError:
+            raise UnsupportedQuery(f'?={key}={value}')
+    return parse_word(f'={key}={value}')[1]
+
+
+def compare(op: str, value: Any, other: Any) -> bool:
+    if value is MISSING:
+        return False
+    if op == '=':
+        return value == other
+    if type(value) is not type(other):
+        value, other = str(value), str(other)
+    return value < other if op == '<' else value > other
+
+
+def evaluate(words: Iterable[str], get: Callable[[str], Any]) -> bool:
+    """
+    Evaluate RouterOS query words against one entry:
+    every ?word pushes a result, ?#! ?#| ?#& combine the topmost ones,
+    the entry matches if all results left on the stack are true
+    """
+    stack: List[bool] = []
+    for word in words:
+        if word.startswith('?#'):
+            for op in word[2:]:
+                if op == '!':
+                    stack.append(not stack.pop())
+                elif op in '|&' and len(stack) >= 2:
+                    right, left = stack.pop(), stack.pop()
+                    stack.append(left or right if op == '|' else left and right)
+                else:
+                    raise UnsupportedQuery(word)
+        elif word[1] in '=<>':
+            key, _, value = word[2:].partition('=')
+            stack.append(compare(word[1], get(key), typed(key, value)))
+        elif word.startswith('?-'):
+            stack.append(get(word[2:]) is MISSING)
+        else:
+            stack.append(get(word[1:]) is not MISSING)
+    return all(stack)
+
+
+class Table:
+    """
+    Entries of one menu packed into tuples.
+    Property names are stored once per table as column indexes,
+    string values are interned, so repeated ones (interface names, flags) share memory.
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.rows: Dict[str, Packed] = {}
+
+    def pack(self, row: MtEntry) -> Packed:
+        for name in row:
+            if name not in self.columns:
+                self.columns[name] = len(self.names)
+                self.names.append(sys.intern(name))
+        values = [MISSING] * (max(self.columns[name] for name in row) + 1) if row else []
+        for name, value in row.items():
+            values[self.columns[name]] = sys.intern(value) if isinstance(value, str) else value
+        return tuple(values)
+
+    def value(self, packed: Packed, name: str) -> Any:
+        index = self.columns.get(name)
+        if index is None or index >= len(packed):
+            return MISSING
+        value = packed[index]
+        if name == '.id' and value is not MISSING:
+            return int(value.lstrip('*'), 16)
+        return value
+
+    def unpack(self, packed: Packed, fields: Tuple[str, ...] = ()) -> MtEntry:
+        # properties come in the order the router sent them, as with .proplist
+        return {name: packed[index] for index, name in enumerate(self.names[:len(packed)])
+                if packed[index] is not MISSING and (not fields or name in fields)}
+
+
+class Mirror:
+    """
+    Local copy of one menu of a host: seeded by print, kept current by listen.
+    Every time the listen breaks, the mirror is dropped and loaded again.
+    """
+
+    def __init__(self, source, connect_args: Dict[str, Any], path: str):
+        self.source = source
+        self.connect_args = connect_args
+        self.path = path.rstrip('/')
+        self.lock = Lock()
+        self.table = Table()
+        self.ready = False
+        Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                changes = subscriptions.subscribe(self.connect_args, self.path)
+                with closing(changes):
+                    next(changes)  # subscribed, changes made during print are queued
+                    self._load(self.source.print(self.path))
+                    for row in changes:
+                        if row is not None:
+                            self._apply(row)
+            except Exception:
+                # whatever broke, the thread lives on and the mirror is loaded again
+                log.exception('Mirror of %s %s is out of sync', self.connect_args['host'], self.path)
+            finally:
+                self.ready = False
+            sleep(MIRROR_RESYNC_DELAY)
+
+    def _load(self, rows: Iterable[MtEntry]):
+        table = Table()
+        for row in rows:
+            table.rows[row['.id']] = table.pack(row)
+        with self.lock:
+            self.table = table
+            self.ready = True
+
+    def _apply(self, row: MtEntry):
+        with self.lock:
+            if row.get('.dead'):
+                self.table.rows.pop(row['.id'], None)
+            else:
+                self.table.rows[row['.id']] = self.table.pack(row)
+
+    def print(self, fields: Tuple[str, ...] = (), words: Tuple[str, ...] = (),
+              limit: Optional[int] = None) -> Tuple[MtEntry, ...]:
+        with self.lock:
+            table, rows = self.table, tuple(self.table.rows.values())
+        found = (packed for packed in rows
+                 if evaluate(words, lambda name: table.value(packed, name)))
+        return tuple(table.unpack(packed, tuple(fields or ())) for packed in islice(found, None if limit is None else int(limit)))
+
+
+class MirroredConnectionManager:
+    """
+    Wraps a connection manager of one host: mirrored menus are printed locally
+    while their mirror is in sync, everything else goes to the router.
+    Mirrors are loaded from `source`, which must not be cached.
+    """
+
+    def __init__(self, cm, source, connect_args: Dict[str, Any], paths: Iterable[str]):
+        self.cm = cm
+        self.mirrors = {path.rstrip('/'): Mirror(source, connect_args, path) for path in paths}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.cm, name)
+
+    def print(self, path: str, fields: Tuple[str, ...] = (),
+              where_fields: Tuple[Where, ...] = (), limit: Optional[int] = None) -> Tuple[MtEntry, ...]:
+        mirror = self.mirrors.get(path.rstrip('/'))
+        words = tuple(chain.from_iterable(where_fields))
+        if mirror is not None and mirror.ready:
+            try:
+                return mirror.print(fields, words, limit)
+            except UnsupportedQuery:
+                pass
+        return self.cm.print(path, fields, (words,), limit)
+
+    def stream(self, path: str, fields: Tuple[str, ...] = (),
+               where_fields: Tuple[Where, ...] = (), limit: Optional[int] = None) -> Iterator[MtEntry]:
+        if path.rstrip('/') not in self.mirrors:
+            return self.cm.stream(path, fields, where_fields, limit)
+        return (row for row in self.print(path, fields, where_fields, limit))
@@ -1,8 +1,16 @@
-from typing import Tuple, Dict, Any, Callable
-from ssl import create_default_context, CERT_NONE, CERT_REQUIRED
+from typing import Tuple, Dict, Any, Callable, Optional, List, Iterator
+from ssl import create_default_context, SSLContext, SSLSession, SSLSocket, CERT_NONE, CERT_REQUIRED
 import settings as setts
 from librouteros.query import Key
-from .connect import ConnectionManager
+from librouteros.protocol import compose_word
+from .connect import ConnectionManager, MuxConnectionManager, Where, Command, CommandResult, MtEntry
+from .broker import BrokerConnectionManager
+from .cache import CachedConnectionManager, response_cache
+from .listen import subscriptions
+from .mirror import MirroredConnectionManager
+from .streaming import stream_response
+from .query import compile_where, QueryError
+from .results import operation_result, bulk_status
 
 
 # GET - parameters in query
@@ -10,55 +18,183 @@ from .connect import ConnectionManager
 # DELETE - parameters in query
 
 
-def add_hostname_to_context(func, hostname):
-    def wrapper(*args, **kwargs):
-        return func(*args, server_hostname=hostname, **kwargs)
-    return wrapper
+class TlsSessionWrapper:
+    """
+    ssl_wrapper resuming the TLS session of the previous connection to the host,
+    so reconnects skip the certificate exchange and key agreement
+    """
+
+    def __init__(self, context: SSLContext, hostname: Optional[str]):
+        self.context = context
+        self.hostname = hostname
+        self.session: Optional[SSLSession] = None
+
+    def __call__(self, sock) -> SSLSocket:
+        ssl_sock = self.context.wrap_socket(sock, server_hostname=self.hostname, session=self.session)
+        self.remember(ssl_sock)
+        return ssl_sock
+
+    def remember(self, ssl_sock: SSLSocket):
+        # with TLS 1.3 the resumable session is only known once the first reply was read
+        if ssl_sock.session is not None:
+            self.session = ssl_sock.session
 
 
 class Node:
 
     @staticmethod
-    def create_ssl_wrapper(hostname: str) -> Callable:
+    def create_ssl_context() -> SSLContext:
         check_cert, check_host = setts.SSL_CHECK_CERT, setts.SSL_CHECK_HOSTNAME
         ctx = create_default_context(cafile=setts.SSL_CAFILE)
         ctx.verify_mode = CERT_REQUIRED if check_cert else CERT_NONE
         ctx.check_hostname = check_host
-        wrapper = ctx.wrap_socket
-        if check_host:
-            wrapper = add_hostname_to_context(wrapper, hostname)
-        return wrapper
+        return ctx
+
+    @staticmethod
+    def create_ssl_wrapper(hostname: str) -> Callable:
+        return TlsSessionWrapper(Node.create_ssl_context(), hostname if setts.SSL_CHECK_HOSTNAME else None)
+
+    @staticmethod
+    def host_timeouts(host: str) -> Tuple[float, float]:
+        """Connect and read timeouts of the host, see HOST_TIMEOUTS"""
+        timeouts = setts.HOST_TIMEOUTS.get(host, {})
+        return timeouts.get('connect', setts.CONNECT_TIMEOUT), timeouts.get('read', setts.READ_TIMEOUT)
+
+    @staticmethod
+    def prepare_query(limit: Optional[int] = None, fields=None, where=None, any=None,
+                      cursor=None, path: str = '') -> Tuple[Tuple[str, ...], Tuple[Where, ...]]:
+        if (where or any) and not fields:
+            fields = ('.id',)
+        where_fields = compile_where(where, any)
+        if cursor:
+            if not Node.id_ordered(path):
+                raise QueryError(f'{path} entries are not known to be printed in .id order, cursor is not supported')
+            # keyset pagination: the device skips everything up to the cursor itself
+            where_fields += (Key('.id') > cursor,)
+        return fields, where_fields
+
+    @staticmethod
+    def id_ordered(path: str) -> bool:
+        """True if the menu is printed in .id order, so it can be paged by cursor, see ID_ORDERED_MENUS"""
+        return path.rstrip('/') in setts.ID_ORDERED_MENUS
 
-    def __init__(self, host, username='admin', password='', use_ssl=False):
+    @staticmethod
+    def page_fields(path: str, limit: Optional[int], fields) -> Tuple[Tuple[str, ...], bool]:
+        """
+        Fields to print for a GET page: the next cursor is taken from .id, which is added if missing.
+        True if it was added, so it is removed from the rows afterwards
+        """
+        if not limit or not fields or '.id' in fields or not Node.id_ordered(path):
+            return fields, False
+        return ('.id', *fields), True
+
+    @staticmethod
+    def page(path: str, limit: Optional[int], rows: Tuple[MtEntry, ...], added_id: bool):
+        """GET reply, a full page gets the cursor of the next one, the greatest .id of its rows"""
+        headers = {}
+        if limit and rows and len(rows) == limit and Node.id_ordered(path):
+            headers['X-Next-Cursor'] = max((row['.id'] for row in rows), key=lambda id: int(id[1:], 16))
+        if added_id:
+            rows = tuple({key: value for key, value in row.items() if key != '.id'} for row in rows)
+        return (rows, 200, headers) if headers else (rows, 200)
+
+    @staticmethod
+    def batch_command(method: str, path: str, body=None, ids=None) -> Command:
+        """RouterOS command for a POST, PATCH or DELETE request"""
+        path = path.rstrip('/')
+        params = dict(body or {})
+        if method == 'post':
+            cmd = path + '/add'
+        elif method == 'patch':
+            cmd = path + '/set'
+            params['.id'] = ','.join(ids or ())
+        else:
+            cmd = path + '/remove'
+            params = {'.id': ','.join(ids or ())}
+        return cmd, tuple(compose_word(k, v) for k, v in params.items())
+
+    def __init__(self, host, username='admin', password='', use_ssl=False, broker=None):
         self.connection_args = {'host': host,
                                 'username': username,
                                 'password': password}
+        self.connection_args['timeout'], self.connection_args['read_timeout'] = Node.host_timeouts(host)
+        self.connection_args['port'] = setts.API_PORT or (8729 if use_ssl else 8728)
         if use_ssl:
             self.connection_args['ssl_wrapper'] = Node.create_ssl_wrapper(host)
-            self.connection_args['port'] = 8729
-        self.cm = ConnectionManager(**self.connection_args)
+        if broker:
+            # RouterOS sessions are opened by the broker process
+            self.cm = BrokerConnectionManager(broker, host)
+        elif setts.API_MULTIPLEX:
+            self.cm = MuxConnectionManager(**self.connection_args)
+        else:
+            self.cm = ConnectionManager(**self.connection_args)
+        self.pool = getattr(self.cm, 'pool', None)  # exported as metrics
+        if not broker:
+            # behind a broker, caching and mirroring are done by the broker itself
+            source = self.cm
+            if setts.CACHE_TTL:
+                self.cm = CachedConnectionManager(self.cm, host, response_cache)
+            if setts.MIRROR_PATHS:
+                self.cm = MirroredConnectionManager(self.cm, source, self.connection_args,
+                                                    setts.MIRROR_PATHS)
+        self.version = self.detect_version() if setts.SPEC_FILES else None
+
+    def detect_version(self) -> Optional[str]:
+        """RouterOS version without the channel, e.g. 6.45.8"""
+        rows = self.cm.print('/system/resource', ('version',))
+        return rows[0]['version'].split()[0] if rows and 'version' in rows[0] else None
 
-    def post(self, path: str, body: Dict[str, Any]) -> Tuple[Dict[str, str], int]:
+    def post(self, path: str, body):
+        if isinstance(body, list):
+            return self.post_many(path, body)
         id = self.cm.add(path, body)
         return {'.id': id}, 201
 
-    def patch(self, path: str, ids: Tuple[str, ...], body: Dict[str, Any]):
+    def post_many(self, path: str, entries: List[Dict[str, Any]]):
+        """Add all entries pipelined on one connection, a failed one doesn't stop the others"""
+        results = self.cm.batch([Node.batch_command('post', path, entry) for entry in entries])
+        replies = [operation_result('post', res) for res in results]
+        return {'results': replies}, bulk_status(replies)
+
+    def patch(self, path: str, body: Dict[str, Any], ids: Optional[Tuple[str, ...]] = None,
+              where=None, any=None):
+        if not ids:
+            count = self.cm.apply_where('set', path, body, Node.required_filter(where, any))
+            return {'count': count}, 200
         id = ','.join(ids)
         body['.id'] = id
         self.cm.update(path, body)
         return '', 204  # No Content
 
-    def get(self, path: str, limit: int = 10 ** 10,
-            fields=None, where=None) -> Tuple[Dict[str, str], int]:
-        if where and not fields:
-            fields = ('.id',)
-        if where is None:
-            where = {}
-        res = self.cm.print(path, fields,
-                            tuple(Key(k) == v for (k, v) in where.items()), limit)
-        return res, 200
+    @staticmethod
+    def required_filter(where=None, any=None) -> Tuple[Where, ...]:
+        """Filter of a PATCH or DELETE without ids, which must not change the whole menu"""
+        if not (where or any):
+            raise QueryError('ids, where or any is required')
+        return compile_where(where, any)
+
+    def get(self, path: str, limit: Optional[int] = None, fields=None, where=None,
+            any=None, stream=None, cursor=None) -> Tuple[Dict[str, str], int]:
+        fields, where_fields = Node.prepare_query(limit, fields, where, any, cursor, path)
+        if stream:
+            return stream_response(self.cm.stream(path, fields, where_fields, limit), stream)
+        fields, added_id = Node.page_fields(path, limit, fields)
+        return Node.page(path, limit, self.cm.print(path, fields, where_fields, limit), added_id)
+
+    def batch(self, operations: List[Dict[str, Any]], stop_on_error=False) -> List[CommandResult]:
+        commands = [Node.batch_command(**op) for op in operations]
+        return self.cm.batch(commands, stop_on_error)
+
+    def listen(self, path: str) -> Iterator[Optional[MtEntry]]:
+        """Changes of the menu, see Subscriptions.subscribe"""
+        if isinstance(self.cm, BrokerConnectionManager):
+            return self.cm.listen(path)
+        return subscriptions.subscribe(self.connection_args, path)
 
-    def delete(self, path, id=None, ids=None):
+    def delete(self, path, id=None, ids=None, where=None, any=None):
+        if not (id or ids):
+            count = self.cm.apply_where('remove', path, {}, Node.required_filter(where, any))
+            return {'count': count}, 200
         if id:
             self.cm.remove(path, (id,))
         if ids:
@@ -0,0 +1,151 @@
+from collections import deque
+from threading import Lock, Event
+from time import monotonic
+from typing import Callable, Deque, Tuple, Optional, Generic, TypeVar
+from . import metrics
+
+
+Conn = TypeVar('Conn')
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection got free within the acquire timeout"""
+    pass
+
+
+class Waiter(Generic[Conn]):
+    def __init__(self):
+        self.event = Event()
+        self.conn: Optional[Conn] = None
+        self.may_open = False  # a connection slot was handed over instead of a connection
+
+
+class Pool(Generic[Conn]):
+    """
+    Bounded pool of connections to one host.
+    Never holds more than `max_size` connections, idle or busy.
+    When all of them are busy, callers wait in FIFO order for up to `acquire_timeout`.
+    Idle connections are closed after `idle_timeout`, busy ones are never touched.
+    """
+
+    def __init__(self, factory: Callable[[], Conn], close: Callable[[Conn], None],
+                 max_size: int, idle_timeout: float, acquire_timeout: float, name: str = ''):
+        self.name = name  # host, labels the pool wait metric
+        self.factory = factory
+        self.close = close
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.acquire_timeout = acquire_timeout
+        self.lock = Lock()
+        self.idle: Deque[Tuple[float, Conn]] = deque()  # the most recently used on the right
+        self.waiters: Deque[Waiter[Conn]] = deque()
+        self.size = 0  # idle + busy + being opened
+        self.last_used = monotonic()  # last acquire
+
+    @property
+    def busy(self) -> int:
+        return self.size - len(self.idle)
+
+    def acquire(self) -> Conn:
+        conn, waiter = None, None
+        with self.lock:
+            self.last_used = monotonic()
+            expired = self._pop_expired()
+            if self.idle and not self.waiters:
+                conn = self.idle.pop()[1]
+            elif self.size < self.max_size and not self.waiters:
+                self.size += 1
+            else:
+                waiter = Waiter()
+                self.waiters.append(waiter)
+        self._close_all(expired)
+        if waiter is not None:
+            return self._wait(waiter)
+        metrics.pool_wait.observe(0, self.name)
+        return conn if conn is not None else self._open()
+
+    def _wait(self, waiter: Waiter[Conn]) -> Conn:
+        started = monotonic()
+        got_free = waiter.event.wait(self.acquire_timeout)
+        metrics.pool_wait.observe(monotonic() - started, self.name)
+        if not got_free:
+            with self.lock:
+                if waiter.conn is None and not waiter.may_open:
+                    self.waiters.remove(waiter)
+                    raise PoolTimeout(f'No free connection within {self.acquire_timeout}s, '
+                                      f'all {self.max_size} are busy')
+        return waiter.conn if waiter.conn is not None else self._open()
+
+    def _open(self) -> Conn:
+        """Open a connection for the slot already reserved by the caller"""
+        try:
+            return self.factory()
+        except BaseException:
+            self._free_slot()
+            raise
+
+    def _free_slot(self):
+        with self.lock:
+            if self.waiters:
+                waiter = self.waiters.popleft()
+                waiter.may_open = True
+                waiter.event.set()
+            else:
+                self.size -= 1
+
+    def release(self, conn: Conn):
+        with self.lock:
+            if self.waiters:
+                waiter = self.waiters.popleft()
+                waiter.conn = conn
+                waiter.event.set()
+            else:
+                self.idle.append((monotonic(), conn))
+            expired = self._pop_expired()
+        self._close_all(expired)
+
+    def discard(self, conn: Conn):
+        """Close a broken connection and give its slot to the next waiter"""
+        self._close_all((conn,))
+        self._free_slot()
+
+    def keep_warm(self, min_idle: int, ping: Callable[[Conn], bool]):
+        """
+        Ping up to `min_idle` most recently used idle connections, which restarts their idle timeout,
+        and open new ones until `min_idle` are idle. Connections failing the ping are closed
+        """
+        with self.lock:
+            expired = self._pop_expired()
+            taken = [self.idle.pop()[1] for _ in range(min(min_idle, len(self.idle)))]
+        self._close_all(expired)
+        for conn in reversed(taken):
+            if ping(conn):
+                self.release(conn)
+            else:
+                self.discard(conn)
+        while True:
+            with self.lock:
+                if len(self.idle) >= min_idle or self.size >= self.max_size or self.waiters:
+                    return
+                self.size += 1
+            self.release(self._open())
+
+    def evict_idle(self):
+        with self.lock:
+            expired = self._pop_expired()
+        self._close_all(expired)
+
+    def _pop_expired(self) -> Tuple[Conn, ...]:
+        deadline = monotonic() - self.idle_timeout
+        expired = []
+        while self.idle and self.idle[0][0] < deadline:
+            expired.append(self.idle.popleft()[1])
+        self.size -= len(expired)
+        return tuple(expired)
+
+    def _close_all(self, conns: Tuple[Conn, ...]):
+        for conn in conns:
+            try:
+                self.close(conn)
+            except OSError:
+                pass
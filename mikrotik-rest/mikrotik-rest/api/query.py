@@ -0,0 +1,67 @@
+from typing import Tuple, Dict, Callable, Union, Optional, Iterator
+from librouteros.query import Key, Or
+from .connect import Where
+
+
+# where[name]=ether1               -> eq
+# where[mtu][gt]=1400              -> operator
+# where[name][in]=ether1,ether2    -> comma separated values
+# where[comment][has]=false        -> property presence
+
+
+class QueryError(Exception):
+    """Raised when where/any filter can't be compiled into a RouterOS query"""
+    pass
+
+
+def In(key: Key, *values: str) -> Where:
+    if len(values) == 1:
+        return key == values[0]
+    return Or(*(key == value for value in values))
+
+
+def Has(key: Key, value: str) -> Where:
+    if value.lower() in ('true', 'yes'):
+        return iter((f'?{key}',))
+    elif value.lower() in ('false', 'no'):
+        return iter((f'?-{key}',))
+    else:
+        raise QueryError(f'"has" expects true or false, got "{value}"')
+
+
+operators: Dict[str, Callable[[Key, str], Where]] = {
+    'eq': lambda key, value: key == value,
+    'ne': lambda key, value: key != value,
+    'lt': lambda key, value: key < value,
+    'gt': lambda key, value: key > value,
+    'in': lambda key, value: In(key, *value.split(',')),
+    'has': Has,
+}
+
+Condition = Union[str, Dict[str, str]]
+
+
+def compile_condition(name: str, condition: Condition) -> Iterator[Where]:
+    key = Key(name)
+    if not isinstance(condition, dict):
+        condition = {'eq': condition}
+    for op, value in condition.items():
+        if op not in operators:
+            raise QueryError(f'Unknown operator "{op}" for "{name}", '
+                             f'supported: {", ".join(operators)}')
+        yield operators[op](key, str(value))
+
+
+def compile_where(where: Optional[Dict[str, Condition]] = None,
+                  any: Optional[Dict[str, Condition]] = None) -> Tuple[Where, ...]:
+    """
+    All conditions from `where` must match,
+    at least one condition from `any` must match
+    """
+    where_fields = tuple(cond for name, condition in (where or {}).items()
+                         for cond in compile_condition(name, condition))
+    any_fields = tuple(cond for name, condition in (any or {}).items()
+                       for cond in compile_condition(name, condition))
+    if len(any_fields) > 1:
+        any_fields = (Or(*any_fields),)
+    return where_fields + any_fields
@@ -0,0 +1,50 @@
+from typing import Dict, Tuple, Any, List
+from librouteros.exceptions import ProtocolError, ConnectionClosed
+from socket import timeout
+from ssl import SSLError
+from .connect import CommandResult
+from .query import QueryError
+from .pool import PoolTimeout
+from .breaker import CircuitOpenError
+from . import metrics
+
+
+# HTTP status of every error a router operation may raise, its subclasses included
+error_codes = {
+    ProtocolError: 400,
+    QueryError: 400,
+    ConnectionClosed: 502,
+    timeout: 503,
+    PoolTimeout: 503,
+    CircuitOpenError: 503,
+    ConnectionError: 502,
+    SSLError: 502
+}
+
+
+def error_response(err: Exception) -> Tuple[Dict[str, str], int]:
+    err_type = type(err)
+    for err_supertype in err_type.mro():
+        if err_supertype in error_codes:
+            metrics.errors.inc(err_supertype.__name__, str(error_codes[err_supertype]))
+            return {'type': '.'.join((err_type.__module__, err_type.__name__)),
+                    'message': str(err)
+                    }, error_codes[err_supertype]
+
+
+def operation_result(method: str, result: CommandResult) -> Dict[str, Any]:
+    """Entry of a /batch or bulk POST reply"""
+    if isinstance(result, Exception):
+        error, status = error_response(result)
+        return {'status': status, 'error': error}
+    if method == 'post':
+        return {'status': 201, 'reply': {'.id': result[0]['ret']}}
+    return {'status': 204}
+
+
+def bulk_status(replies: List[Dict[str, Any]]) -> int:
+    """201 if every entry was created, 400 if none was, 207 (Multi-Status) for a partial success"""
+    created = sum(reply['status'] == 201 for reply in replies)
+    if created == len(replies):
+        return 201
+    return 207 if created else 400
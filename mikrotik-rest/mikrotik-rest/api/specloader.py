@@ -0,0 +1,55 @@
+import json
+import os
+import pickle
+from hashlib import sha256
+from importlib.metadata import version
+from pathlib import Path
+from typing import Dict, Any, Optional
+import jinja2
+import yaml
+from connexion.spec import Specification
+from settings import SPEC_CACHE_DIR
+
+
+class CompiledSpec(dict):
+    """Rendered spec which passed validation when it was compiled"""
+    pass
+
+
+def compile_spec(source: bytes, arguments: Dict[str, Any]) -> CompiledSpec:
+    text = jinja2.Template(source.decode()).render(**arguments)
+    raw = yaml.load(text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    # raises connexion.exceptions.InvalidSpecification
+    return CompiledSpec(Specification.from_dict(raw).raw)
+
+
+def cache_path(spec_file: str, source: bytes, arguments: Dict[str, Any]) -> Path:
+    key = sha256(source)
+    key.update(json.dumps(arguments, sort_keys=True).encode())
+    key.update(version('connexion').encode())  # connexion upgrades may change the result
+    return Path(SPEC_CACHE_DIR) / f'{Path(spec_file).stem}-{key.hexdigest()[:16]}.pickle'
+
+
+def load_spec(spec_file: str, arguments: Optional[Dict[str, Any]] = None) -> CompiledSpec:
+    """
+    Spec ready for add_api. Parsing and validation of the yaml take seconds,
+    so their result is kept in SPEC_CACHE_DIR for every version of the file.
+    """
+    arguments = arguments or {}
+    source = Path(spec_file).read_bytes()
+    path = cache_path(spec_file, source, arguments)
+    try:
+        with path.open('rb') as cached:
+            return pickle.load(cached)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+    spec = compile_spec(source, arguments)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        with tmp_path.open('wb') as tmp:
+            pickle.dump(spec, tmp, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)  # workers booting at once never read a partial file
+    except OSError:
+        pass  # read-only deployment, compile on every boot
+    return spec
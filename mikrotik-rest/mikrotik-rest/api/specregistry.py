@@ -0,0 +1,77 @@
+from collections import defaultdict
+from threading import Lock
+from time import monotonic
+from typing import Dict, Optional
+from connexion.spec import Specification
+from .lazyapi import Operations, load_specification
+from .specloader import load_spec
+from settings import SPEC_ARGUMENTS
+
+
+def version_key(version: str) -> tuple:
+    return tuple(version.split('.'))
+
+
+class SpecRegistry:
+    """
+    Specs of SPEC_FILES by RouterOS version.
+    A spec is loaded when the first host running its version is requested
+    and dropped after it wasn't used for `idle_timeout`.
+    """
+
+    def __init__(self, api, spec_files: Dict[str, str], idle_timeout: float):
+        self.api = api
+        # the most specific version prefix first: 6.45 before 6
+        self.spec_files = dict(sorted(spec_files.items(), key=lambda item: -len(version_key(item[0]))))
+        self.idle_timeout = idle_timeout
+        self.lock = Lock()
+        self.loaded: Dict[str, Operations] = {}
+        self.last_used: Dict[str, float] = {}
+        self.load_locks: Dict[str, Lock] = defaultdict(Lock)
+
+    def spec_file(self, version: Optional[str]) -> Optional[str]:
+        if not version:
+            return None
+        version = version_key(version)
+        for prefix, spec_file in self.spec_files.items():
+            prefix = version_key(prefix)
+            if version[:len(prefix)] == prefix:
+                return spec_file
+        return None
+
+    def for_host(self, hostname: str) -> Optional[Operations]:
+        """Operations of the host's spec, None to use the default one"""
+        from .apiendpoints import Resolver, Endpoint
+        try:
+            version = Resolver.get_node(hostname).version
+        except tuple(Endpoint.error_codes):
+            return None  # the request fails on its own with the default spec
+        spec_file = self.spec_file(version)
+        return self.get(spec_file) if spec_file else None
+
+    def get(self, spec_file: str) -> Operations:
+        operations = self.loaded.get(spec_file)
+        if operations is None:
+            # hosts of other versions are served while this one loads
+            with self.load_locks[spec_file]:
+                operations = self.loaded.get(spec_file)
+                if operations is None:
+                    operations = Operations(self.api, self.load(spec_file))
+                    with self.lock:
+                        self.loaded[spec_file] = operations
+        with self.lock:
+            self.last_used[spec_file] = monotonic()
+        self.evict_idle()
+        return operations
+
+    @staticmethod
+    def load(spec_file: str) -> Specification:
+        return load_specification(load_spec(spec_file, SPEC_ARGUMENTS))
+
+    def evict_idle(self):
+        deadline = monotonic() - self.idle_timeout
+        with self.lock:
+            for spec_file, last_used in tuple(self.last_used.items()):
+                if last_used < deadline:
+                    del self.last_used[spec_file]
+                    self.loaded.pop(spec_file, None)
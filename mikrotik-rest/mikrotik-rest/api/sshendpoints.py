@@ -1,17 +1,58 @@
-import re, time
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from mtwlib import Ssh
-from settings import USERNAME, PASSWORD
+import re, atexit
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Event
+from typing import Dict, Any, List
+from paramiko import SSHException
+from mtwlib import SshPool
+from mtwlib.mtssh import AlreadyConnectedError, SafeModeError
+from settings import USERNAME, PASSWORD, SSH_COMMAND_TIMEOUT, SSH_IDLE_TIMEOUT, SSH_KEEPALIVE, \
+    TEMPLATE_WORKERS, TEMPLATE_HOST_TIMEOUT
+from .fanoutendpoints import host_results, error_entry
+from .streaming import ndjson, chunked_response
 
 
-def exec_commands(host, commands):
+ssh_pool = SshPool(USERNAME, PASSWORD, colored=False,
+                   idle_timeout=SSH_IDLE_TIMEOUT, keepalive=SSH_KEEPALIVE)
+# closing enables echo logging back on the routers. uwsgi workers don't run atexit hooks
+try:
+    import uwsgi
+    uwsgi.atexit = ssh_pool.close_idle
+except ImportError:
+    atexit.register(ssh_pool.close_idle)
+
+# shared by all requests, so the hosts handled at once are bounded regardless of their number
+template_executor = ThreadPoolExecutor(max_workers=TEMPLATE_WORKERS)
+
+# ssh failures of a host, the others are mapped by Endpoint.error_codes
+ssh_error_codes = {
+    AlreadyConnectedError: 503,
+    SafeModeError: 409,
+    SSHException: 502
+}
+
+
+class TemplateCancelled(Exception):
+    """Raised when the result of a host is no longer awaited, its changes are rolled back"""
+    pass
+
+
+def check_cancelled(host: str, cancelled: Event):
+    # checked before every command and before safe mode is released,
+    # so a host reported as failed is not left configured
+    if cancelled.is_set():
+        raise TemplateCancelled(f'{host}: no reply awaited, changes rolled back')
+
+
+def exec_commands(host: str, commands: List[str], cancelled: Event) -> Dict[str, str]:
     results = {}
-    with Ssh(host, USERNAME, PASSWORD, colored=False) as ssh:
+    with ssh_pool.session(host) as ssh:
         with ssh.safe_mode():
             for cmd in commands:
-                ssh.send(cmd+'\r\n')
-                time.sleep(0.1)
-                output = ssh.read_all()
+                check_cancelled(host, cancelled)
+                # Ctrl-C is needed only if the previous command didn't finish in time
+                ssh.send(cmd+'\r\n', interrupt=not ssh.at_prompt)
+                output = ssh.read_until(timeout=SSH_COMMAND_TIMEOUT)
                 results[cmd] = search.group(1) if (search := re.search(
                     r'{}(?:[\r\n]*)(.*?)(?:[\r\n]*)\[{}'.format(
                         cmd+'\r\n',
@@ -20,20 +61,23 @@ def exec_commands(host, commands):
                     output,
                     re.MULTILINE | re.DOTALL
                 )) else output
-    return {host: results}
+            check_cancelled(host, cancelled)
+    return results
 
 
-def run_template(body):
-    results = {}
-    with ThreadPoolExecutor() as executor:
-        futures = []
-        for host in body['hosts']:
-            futures.append(
-                executor.submit(exec_commands, host, body['commands'])
-            )
-        for future in as_completed(futures):
-            try:
-                results.update(future.result())
-            finally:  # TODO add exceptions handling
-                pass
-        return results, 200
+def template_host(host: str, cancelled: Event, commands: List[str]) -> Dict[str, Any]:
+    try:
+        return {'host': host, 'reply': exec_commands(host, commands, cancelled)}
+    except tuple(ssh_error_codes) as err:
+        code = next(ssh_error_codes[t] for t in type(err).mro() if t in ssh_error_codes)
+        return error_entry(host, code, str(err))
+
+
+def run_template(body, stream=None):
+    hosts = list(dict.fromkeys(body['hosts']))  # deduplicated, order kept
+    timeout = body.get('timeout', TEMPLATE_HOST_TIMEOUT)
+    results = host_results(hosts, partial(template_host, commands=body['commands']),
+                           template_executor, timeout)
+    if stream == 'ndjson':
+        return chunked_response(ndjson(results), 'application/x-ndjson')
+    return {'hosts': list(results)}, 200
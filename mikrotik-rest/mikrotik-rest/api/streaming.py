@@ -0,0 +1,55 @@
+import json
+from contextlib import closing
+from typing import Iterator, Callable, Dict, Tuple, Optional
+from flask import Response, has_request_context
+from .connect import MtEntry
+
+
+def started(rows: Iterator[MtEntry]) -> Iterator[MtEntry]:
+    """Run the query up to its first row, so connection errors surface before the response starts"""
+    first = next(rows, None)
+
+    def resume():
+        with closing(rows):
+            if first is not None:
+                yield first
+            yield from rows
+    return resume()
+
+
+def json_array(rows: Iterator[MtEntry]) -> Iterator[str]:
+    separator = ''
+    yield '['
+    with closing(rows):
+        for row in rows:
+            yield separator + json.dumps(row)
+            separator = ','
+    yield ']\n'
+
+
+def ndjson(rows: Iterator[MtEntry]) -> Iterator[str]:
+    with closing(rows):
+        for row in rows:
+            yield json.dumps(row) + '\n'
+
+
+formats: Dict[str, Tuple[Callable[[Iterator[MtEntry]], Iterator[str]], str]] = {
+    'json': (json_array, 'application/json'),
+    'ndjson': (ndjson, 'application/x-ndjson'),
+}
+
+
+def chunked_response(chunks: Iterator[str], mimetype: str, headers: Optional[Dict[str, str]] = None):
+    """
+    Streamed response of the framework serving the request: Flask under app.py,
+    Starlette under asgi.py, where the chunks are produced in its thread pool
+    """
+    if has_request_context():
+        return Response(chunks, mimetype=mimetype, headers=headers)
+    from starlette.responses import StreamingResponse
+    return StreamingResponse(chunks, media_type=mimetype, headers=headers)
+
+
+def stream_response(rows: Iterator[MtEntry], fmt: str = 'json') -> Response:
+    encode, mimetype = formats[fmt]
+    return Response(encode(started(rows)), mimetype=mimetype)
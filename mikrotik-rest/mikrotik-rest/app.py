@@ -1,12 +1,17 @@
 #!/usr/bin/env python3
 import connexion
 from misc import check_settings
-from settings import SPEC_FILE
+from settings import SPEC_FILE, SPEC_ARGUMENTS
+from api.specloader import load_spec
+from api.lazyapi import LazyFlaskApi
+from api import metrics
 
 check_settings.check_all()
 app = connexion.FlaskApp('mikrotik-rest')
-app.add_api(SPEC_FILE,
-            arguments={'title': 'Mikrotik RESTful API'})
+app.api_cls = LazyFlaskApi
+app.add_api(load_spec(SPEC_FILE, SPEC_ARGUMENTS),
+            arguments=SPEC_ARGUMENTS)
+metrics.init_app(app.app)
 
 if __name__ == '__main__':
     app.run()
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+import connexion
+from connexion.resolver import Resolver
+from misc import check_settings
+from settings import SPEC_FILE, SPEC_ARGUMENTS
+from api.aioendpoints import resolve_function
+from api.specloader import load_spec
+from api.metrics import MetricsMiddleware
+
+# asyncio variant of app.py, requires requirements-asgi.txt.
+# It uses connexion 3 routing as is, without app.py's LazyFlaskApi, which needs connexion 2.7.0
+# uvicorn asgi:app --port 8080
+check_settings.check_all()
+app = connexion.AsyncApp('mikrotik-rest')
+app.add_api(load_spec(SPEC_FILE, SPEC_ARGUMENTS),
+            resolver=Resolver(function_resolver=resolve_function))
+app.add_middleware(MetricsMiddleware)
+
+if __name__ == '__main__':
+    app.run(port=8080)
@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+import sys
+from api.broker import serve
+from settings import BROKER_SOCKET
+
+if __name__ == '__main__':
+    if not BROKER_SOCKET:
+        sys.exit('MIKROTIK_BROKER_SOCKET environment variable is not set')
+    serve(BROKER_SOCKET)
@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+from api.specloader import load_spec
+from settings import SPEC_FILE, SPEC_FILES, SPEC_ARGUMENTS
+
+# Build step: parse and validate the specs once, so workers boot from the cache.
+# Run after every spec change, e.g. in the Dockerfile
+if __name__ == '__main__':
+    for spec_file in (SPEC_FILE, *SPEC_FILES.values()):
+        load_spec(spec_file, SPEC_ARGUMENTS)
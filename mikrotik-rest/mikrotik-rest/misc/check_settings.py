@@ -29,6 +29,14 @@ def check_ssl():
         raise SettingsError(f'SSL_CAFILE: {ca_path.absolute()} does not exist')
 
 
+@register
+def check_keepalive():
+    if KEEPALIVE_INTERVAL and KEEPALIVE_INTERVAL >= CONN_TIMEOUT:
+        raise SettingsError('KEEPALIVE_INTERVAL must be lower than CONN_TIMEOUT')
+    if POOL_MIN_IDLE > MAX_CONN_PER_HOST:
+        raise SettingsError('POOL_MIN_IDLE must not exceed MAX_CONN_PER_HOST')
+
+
 @register
 def check_spec():
     spec_path = Path(SPEC_FILE)
@@ -6,14 +6,105 @@ PASSWORD = os.environ.get('MIKROTIK_PASSWD','test')
 
 # openapi specification file
 SPEC_FILE = 'api/spec.yaml'
+SPEC_ARGUMENTS = {'title': 'Mikrotik RESTful API'}
+# parsed and validated SPEC_FILE is cached here, see compile_spec.py
+SPEC_CACHE_DIR = '.spec_cache'
+# Specs for particular RouterOS versions, e.g. {'6.45': 'api/spec-6.45.yaml', '7': 'api/spec-7.yaml'}.
+# A host is served by the spec of the longest matching version prefix, SPEC_FILE if none.
+# Each spec is loaded when first needed and dropped after SPEC_IDLE_TIMEOUT seconds unused
+SPEC_FILES = {}
+SPEC_IDLE_TIMEOUT = 3600
 
-# Maximum simultaneous connections stored per host (length of list)
-# More than that will be dropped after the end of operation
+# Menus whose entries are printed in .id order: their entries can't be moved and new ones get a greater .id.
+# Only GETs of them support cursor pagination, a cursor on any other menu is rejected
+ID_ORDERED_MENUS = ('/ip/address', '/ipv6/address', '/ip/arp', '/ipv6/neighbor', '/ip/pool',
+                    '/ip/dhcp-server/lease', '/ip/firewall/address-list', '/ipv6/firewall/address-list',
+                    '/ip/firewall/connection')
+# Maximum simultaneous connections per host
+# When all of them are busy, requests wait in a queue for a free one
 MAX_CONN_PER_HOST = 10
+# Seconds to wait for a router to accept a connection and log in,
+# and for every reply afterwards. Overridden per host by HOST_TIMEOUTS,
+# e.g. {'10.0.0.1': {'connect': 3, 'read': 60}}
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 10
+HOST_TIMEOUTS = {}
+# After CIRCUIT_FAILURES consecutive failed connects to a host its requests get 503 at once.
+# A single background probe retries the connect every CIRCUIT_COOLDOWN seconds,
+# requests are let through again after it succeeds
+CIRCUIT_FAILURES = 3
+CIRCUIT_COOLDOWN = 30
 # Idle open connection will be dropped after this timeout
 CONN_TIMEOUT = 120
+# Queued request gets 503 if no connection got free within this timeout
+POOL_ACQUIRE_TIMEOUT = 10
+# Filter-based PATCH and DELETE change the matched entries by this number of ids per command
+IDS_PER_COMMAND = 1000
+# Background maintainer keeping connections of hot hosts open: HOT_HOSTS, e.g. ('10.0.0.1',),
+# and the hosts requested within the last HOT_HOST_WINDOW seconds.
+# Every KEEPALIVE_INTERVAL seconds each of them gets POOL_MIN_IDLE idle connections,
+# opened ahead of requests if needed, and a cheap command on each, so they don't reach CONN_TIMEOUT.
+# KEEPALIVE_WORKERS hosts are handled at once, KEEPALIVE_INTERVAL = 0 disables the maintainer
+HOT_HOSTS = ()
+HOT_HOST_WINDOW = 600
+POOL_MIN_IDLE = 1
+KEEPALIVE_INTERVAL = 60
+KEEPALIVE_WORKERS = 10
+# Run concurrent commands over a single tagged connection per host
+# instead of a pool of up to MAX_CONN_PER_HOST connections
+API_MULTIPLEX = os.environ.get('MIKROTIK_API_MULTIPLEX', '').lower() in ('1', 'true', 'yes')
+
+# Unix socket of the broker process (broker.py) owning all RouterOS
+# API connections. Workers forward their queries to it, so connections per host
+# are bounded by MAX_CONN_PER_HOST regardless of the number of uwsgi workers.
+# Disabled (each worker keeps its own connections) if not set
+BROKER_SOCKET = os.environ.get('MIKROTIK_BROKER_SOCKET')
+# Worker gives up waiting for a broker reply after this timeout
+BROKER_TIMEOUT = 60
+
+# Seconds to cache GET replies per menu, e.g. {'/interface': 5, '/ip/address': 30}.
+# Menus not listed are never cached. Writes made through this server drop
+# cached replies of the written menu. With BROKER_SOCKET the cache is shared by all workers
+CACHE_TTL = {}
+# Cached queries kept at most, the least recently used are dropped first
+CACHE_MAX_ENTRIES = 1000
+
+# Menus kept in memory for every host, e.g. ('/interface', '/ip/arp').
+# Loaded once, then updated by listen; GETs of them are answered locally
+MIRROR_PATHS = ()
+# Seconds to wait before reloading a mirror after its listen connection broke
+MIRROR_RESYNC_DELAY = 5
+
+# /subscribe: seconds between keepalive comments sent to idle clients,
+# and changes a client may fall behind before it is disconnected
+LISTEN_HEARTBEAT = 15
+LISTEN_QUEUE_SIZE = 1000
+# /subscribe clients served at once by a worker, the next ones get 503.
+# Under uwsgi each of them holds one of its threads, keep it below `threads` in uwsgi.ini
+LISTEN_MAX_CLIENTS = 5
+
+# /fanOut defaults: hosts queried at once and time limit for every host
+FANOUT_CONCURRENCY = 50
+# /fanOut: hosts queried at once by all requests together, caps the concurrency of a request
+FANOUT_WORKERS = 100
+FANOUT_HOST_TIMEOUT = 30
+
+# /runTemplate: seconds to wait for the prompt after every command
+SSH_COMMAND_TIMEOUT = 30
+# /runTemplate keeps one ssh session per host open between requests.
+# It is closed after SSH_IDLE_TIMEOUT seconds unused, ssh keepalives are sent every SSH_KEEPALIVE seconds.
+# Echo logging of the router stays disabled while its session is open, and for good
+# if the worker is killed before closing it, so keep this short
+SSH_IDLE_TIMEOUT = 60
+SSH_KEEPALIVE = 30
+# /runTemplate: hosts handled at once by all requests together,
+# and default time limit for every host
+TEMPLATE_WORKERS = 50
+TEMPLATE_HOST_TIMEOUT = 120
 
 API_TRANSPORT = 'TCP'  # 'SSL' or 'TCP'
+# RouterOS API port of every host, by default 8728, or 8729 with SSL
+API_PORT = int(os.environ.get('MIKROTIK_API_PORT', 0)) or None
 SSL_CHECK_CERT = True
 SSL_CHECK_HOSTNAME = True
 SSL_CAFILE = 'misc/rootCA.crt'
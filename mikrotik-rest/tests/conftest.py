@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+import pytest
+
+# the app imports `api` and `settings` from its own directory, as uwsgi runs it
+root = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(root / 'mikrotik-rest'), str(root / 'bench'), str(root.parent / 'mtwlib')]
+
+
+@pytest.fixture
+def router():
+    """bench/fake_router.py on a free port, connect to router.server_address"""
+    import fake_router
+    server = fake_router.serve(port=0)
+    yield server
+    server.shutdown()
+    server.server_close()
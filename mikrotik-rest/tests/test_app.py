@@ -0,0 +1,83 @@
+import os
+from pathlib import Path
+import pytest
+
+# LazyFlaskApi routes requests with connexion internals, these boot the real app on the pinned release
+
+APP_DIR = Path(__file__).resolve().parents[1] / 'mikrotik-rest'
+
+
+@pytest.fixture(scope='module')
+def client():
+    import fake_router
+    import settings
+    from misc import check_settings
+    server = fake_router.serve(port=0)
+    settings.API_PORT = server.server_address[1]
+    check_settings.SSL_CAFILE = __file__  # the CA is deployment specific, TCP doesn't use it
+    cwd = os.getcwd()
+    os.chdir(APP_DIR)  # spec paths are relative to the app
+    try:
+        import app
+        yield app.app.app.test_client()
+    finally:
+        os.chdir(cwd)
+        settings.API_PORT = None
+        server.shutdown()
+        server.server_close()
+
+
+def test_get(client):
+    response = client.get('/v1/127.0.0.1/interface?fields=name,mtu')
+    assert response.status_code == 200
+    assert response.get_json()[0] == {'name': 'ether0', 'mtu': 1500}
+
+
+def test_nested_path_with_filter(client):
+    response = client.get('/v1/127.0.0.1/ip/address?fields=address&where[address]=10.0.0.7/32')
+    assert response.status_code == 200
+    assert response.get_json() == [{'address': '10.0.0.7/32'}]
+
+
+def test_path_without_id(client):
+    response = client.get('/v1/127.0.0.1/system/resource')
+    assert response.status_code == 200
+    assert response.get_json()[0]['board-name'] == 'fake'
+
+
+def test_post_patch_delete(client):
+    response = client.post('/v1/127.0.0.1/ip/address', json={'address': '192.168.88.1/24', 'interface': 'ether1'})
+    assert response.status_code == 201
+    id = response.get_json()['.id']
+    assert client.patch(f'/v1/127.0.0.1/ip/address?ids={id}', json={'comment': 'lan'}).status_code < 300
+    found = client.get('/v1/127.0.0.1/ip/address?fields=comment&where[comment]=lan').get_json()
+    assert found == [{'comment': 'lan'}]
+    assert client.delete(f'/v1/127.0.0.1/ip/address?ids={id}').status_code < 300
+
+
+def test_parameters_are_validated(client):
+    response = client.get('/v1/127.0.0.1/interface?limit=many')
+    assert response.status_code == 400
+
+
+def test_unknown_path(client):
+    assert client.get('/v1/127.0.0.1/no/such/menu').status_code == 404
+
+
+def test_method_not_in_spec(client):
+    assert client.get('/v1/127.0.0.1/interface').status_code == 200
+    assert client.post('/v1/127.0.0.1/interface', json={'name': 'x'}).status_code in (404, 405)
+
+
+def test_cursor_pages_id_ordered_menu(client):
+    first = client.get('/v1/127.0.0.1/ip/address?fields=address&limit=2')
+    assert len(first.get_json()) == 2 and '.id' not in first.get_json()[0]
+    cursor = first.headers['X-Next-Cursor']
+    second = client.get(f'/v1/127.0.0.1/ip/address?fields=address&limit=2&cursor={cursor}')
+    assert second.status_code == 200
+    assert not {row['address'] for row in first.get_json()} & {row['address'] for row in second.get_json()}
+
+
+def test_cursor_is_rejected_on_other_menus(client):
+    assert 'X-Next-Cursor' not in client.get('/v1/127.0.0.1/interface?limit=2').headers
+    assert client.get('/v1/127.0.0.1/interface?limit=2&cursor=*1').status_code == 400
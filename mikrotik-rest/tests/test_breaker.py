@@ -0,0 +1,108 @@
+import socket
+from time import sleep, monotonic
+import pytest
+from api.breaker import CircuitBreaker, CircuitOpenError, breakers, get_breaker
+from api.connect import ConnectionManager
+
+
+class Factory:
+    """Connect function failing while `up` is False"""
+
+    def __init__(self):
+        self.up = False
+        self.calls = 0
+
+    def __call__(self) -> str:
+        self.calls += 1
+        if not self.up:
+            raise ConnectionRefusedError
+        return 'conn'
+
+
+def connect(breaker: CircuitBreaker, factory: Factory) -> str:
+    return breaker.connect(factory, lambda conn: None)
+
+
+def wait_closed(breaker: CircuitBreaker, timeout: float = 2):
+    deadline = monotonic() + timeout
+    while breaker.is_open and monotonic() < deadline:
+        sleep(0.01)
+
+
+def test_opens_after_consecutive_failures():
+    breaker, factory = CircuitBreaker('r1', failures=2, cooldown=60), Factory()
+    for _ in range(2):
+        with pytest.raises(ConnectionRefusedError):
+            connect(breaker, factory)
+    assert breaker.is_open
+    with pytest.raises(CircuitOpenError):
+        connect(breaker, factory)
+    assert factory.calls == 2  # failed fast, without connecting
+
+
+def test_success_resets_the_count():
+    breaker, factory = CircuitBreaker('r1', failures=2, cooldown=60), Factory()
+    with pytest.raises(ConnectionRefusedError):
+        connect(breaker, factory)
+    factory.up = True
+    connect(breaker, factory)
+    factory.up = False
+    with pytest.raises(ConnectionRefusedError):
+        connect(breaker, factory)
+    assert not breaker.is_open and breaker.failed == 1
+
+
+def test_other_errors_are_not_counted():
+    breaker = CircuitBreaker('r1', failures=1, cooldown=60)
+
+    def login_trap():
+        raise ValueError('invalid user name or password')
+
+    with pytest.raises(ValueError):
+        breaker.connect(login_trap, lambda conn: None)
+    assert not breaker.is_open and breaker.failed == 0
+
+
+def test_probe_closes_the_circuit():
+    breaker, factory = CircuitBreaker('r1', failures=1, cooldown=0.02), Factory()
+    with pytest.raises(ConnectionRefusedError):
+        connect(breaker, factory)
+    sleep(0.1)
+    assert breaker.is_open and factory.calls > 1  # the probe keeps retrying
+    factory.up = True
+    wait_closed(breaker)
+    assert not breaker.is_open and breaker.failed == 0
+    assert connect(breaker, factory) == 'conn'
+
+
+@pytest.fixture
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def breaker():
+    # keyed by host, so the other tests connecting to 127.0.0.1 keep theirs
+    breaker = get_breaker('localhost')
+    breaker.failures, breaker.cooldown = 2, 0.02
+    yield breaker
+    del breakers['localhost']
+
+
+def test_manager_fails_fast_until_the_router_is_back(free_port, breaker):
+    import fake_router
+    connect_args = {'host': 'localhost', 'port': free_port, 'username': 'admin', 'password': ''}
+    for _ in range(2):
+        with pytest.raises(ConnectionRefusedError):
+            ConnectionManager(**connect_args)
+    with pytest.raises(CircuitOpenError):
+        ConnectionManager(**connect_args)
+    server = fake_router.serve(port=free_port)
+    try:
+        wait_closed(breaker)
+        assert len(ConnectionManager(**connect_args).print('/interface')) == 5
+    finally:
+        server.shutdown()
+        server.server_close()
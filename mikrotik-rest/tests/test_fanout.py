@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from time import sleep
+from api.fanoutendpoints import host_results
+
+
+class Task:
+    """Host task counting how many hosts run at once"""
+
+    def __init__(self, duration: float = 0.02):
+        self.duration = duration
+        self.lock = Lock()
+        self.running = 0
+        self.most = 0
+
+    def __call__(self, host: str, cancelled: Event):
+        with self.lock:
+            self.running += 1
+            self.most = max(self.most, self.running)
+        sleep(self.duration)
+        with self.lock:
+            self.running -= 1
+        return {'host': host, 'reply': []}
+
+
+def test_concurrency_is_capped_per_request():
+    task = Task()
+    with ThreadPoolExecutor(10) as executor:
+        results = list(host_results([f'r{i}' for i in range(12)], task, executor, 5, concurrency=3))
+    assert sorted(result['host'] for result in results) == sorted(f'r{i}' for i in range(12))
+    assert task.most == 3
+
+
+def test_timed_out_host_is_cancelled():
+    cancelled = []
+
+    def task(host: str, event: Event):
+        event.wait(2)
+        cancelled.append(event.is_set())
+        return {'host': host, 'reply': []}
+
+    with ThreadPoolExecutor(2) as executor:
+        results = list(host_results(['r1'], task, executor, 0.05))
+    assert results[0]['errorCode'] == 504 and cancelled == [True]
@@ -0,0 +1,36 @@
+from time import sleep, monotonic
+from api import mirror
+from api.connect import ConnectionManager
+from api.pool import PoolTimeout
+
+
+class FailingFirst:
+    """Source whose first print fails with an error the router didn't cause"""
+
+    def __init__(self, cm: ConnectionManager):
+        self.cm = cm
+        self.prints = 0
+
+    def print(self, path: str):
+        self.prints += 1
+        if self.prints == 1:
+            raise PoolTimeout('No free connection')
+        return self.cm.print(path)
+
+
+def wait_ready(table_mirror: mirror.Mirror, timeout: float = 5) -> bool:
+    deadline = monotonic() + timeout
+    while not table_mirror.ready and monotonic() < deadline:
+        sleep(0.01)
+    return table_mirror.ready
+
+
+def test_mirror_recovers_from_a_failed_load(router, monkeypatch):
+    monkeypatch.setattr(mirror, 'MIRROR_RESYNC_DELAY', 0.05)
+    host, port = router.server_address
+    connect_args = {'host': host, 'port': port, 'username': 'admin', 'password': ''}
+    source = FailingFirst(ConnectionManager(**connect_args))
+    table_mirror = mirror.Mirror(source, connect_args, '/interface')
+    assert wait_ready(table_mirror)
+    assert source.prints == 2
+    assert [row['name'] for row in table_mirror.print(('name',))] == [f'ether{i}' for i in range(5)]
@@ -0,0 +1,123 @@
+from itertools import count
+from threading import Thread
+from time import sleep
+import pytest
+from api.connect import ConnectionManager
+from api.pool import Pool, PoolTimeout
+
+
+class Conns:
+    """Connection factory, connections are numbers"""
+
+    def __init__(self):
+        self.numbers = count(1)
+        self.closed = []
+
+    def open(self) -> int:
+        return next(self.numbers)
+
+    def close(self, conn: int):
+        self.closed.append(conn)
+
+
+def make_pool(conns: Conns, max_size=2, idle_timeout=60, acquire_timeout=1) -> Pool:
+    return Pool(conns.open, conns.close, max_size, idle_timeout, acquire_timeout)
+
+
+def acquire_later(pool: Pool, got: list) -> Thread:
+    thread = Thread(target=lambda: got.append(pool.acquire()))
+    thread.start()
+    sleep(0.05)  # queued behind the busy connections
+    return thread
+
+
+def test_idle_connection_is_reused():
+    pool = make_pool(Conns())
+    pool.release(pool.acquire())
+    assert pool.acquire() == 1
+    assert pool.size == 1
+
+
+def test_size_is_capped():
+    pool = make_pool(Conns(), max_size=2, acquire_timeout=0.05)
+    assert (pool.acquire(), pool.acquire()) == (1, 2)
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.size == 2 and not pool.waiters
+
+
+def test_waiter_gets_the_released_connection():
+    pool = make_pool(Conns(), max_size=1)
+    conn = pool.acquire()
+    got = []
+    thread = acquire_later(pool, got)
+    assert not got
+    pool.release(conn)
+    thread.join()
+    assert got == [conn] and pool.size == 1
+
+
+def test_waiters_are_served_in_order():
+    pool = make_pool(Conns(), max_size=1)
+    conn = pool.acquire()
+    first, second = [], []
+    threads = [acquire_later(pool, first), acquire_later(pool, second)]
+    pool.release(conn)
+    threads[0].join()
+    assert first == [conn] and not second
+    pool.release(conn)
+    threads[1].join()
+    assert second == [conn]
+
+
+def test_discarded_slot_goes_to_a_waiter():
+    conns = Conns()
+    pool = make_pool(conns, max_size=1)
+    conn = pool.acquire()
+    got = []
+    thread = acquire_later(pool, got)
+    pool.discard(conn)
+    thread.join()
+    assert conns.closed == [conn] and got == [2] and pool.size == 1
+
+
+def test_failed_open_frees_the_slot():
+    def fail():
+        raise ConnectionRefusedError
+
+    pool = Pool(fail, lambda conn: None, max_size=1, idle_timeout=60, acquire_timeout=0.05)
+    for _ in range(2):
+        with pytest.raises(ConnectionRefusedError):
+            pool.acquire()
+    assert pool.size == 0
+
+
+def test_idle_connections_expire():
+    conns = Conns()
+    pool = make_pool(conns, idle_timeout=0.05)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    sleep(0.1)
+    pool.evict_idle()
+    assert conns.closed == [first] and pool.size == 1
+    pool.release(second)
+    sleep(0.1)
+    assert pool.acquire() == 3  # the expired one is closed instead of reused
+    assert conns.closed == [first, second] and pool.size == 1
+
+
+def test_busy_connections_never_expire():
+    conns = Conns()
+    pool = make_pool(conns, idle_timeout=0.05)
+    pool.acquire()
+    sleep(0.1)
+    pool.evict_idle()
+    assert not conns.closed and pool.busy == 1
+
+
+def test_manager_reuses_the_login(router):
+    host, port = router.server_address
+    cm = ConnectionManager(host=host, port=port, username='admin', password='')
+    for _ in range(3):
+        assert len(cm.print('/interface', ('name',))) == 5
+    assert router.router.logins == 1 and cm.pool.size == 1
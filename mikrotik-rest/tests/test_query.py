@@ -0,0 +1,69 @@
+import pytest
+from api.query import compile_where, QueryError
+
+
+def words(where=None, any=None):
+    return [tuple(cond) for cond in compile_where(where, any)]
+
+
+def test_plain_value_is_eq():
+    assert words({'name': 'ether1'}) == [('?=name=ether1',)]
+
+
+@pytest.mark.parametrize('op, expected', [
+    ('eq', ('?=mtu=1400',)),
+    ('ne', ('?=mtu=1400', '?#!')),
+    ('lt', ('?<mtu=1400',)),
+    ('gt', ('?>mtu=1400',)),
+])
+def test_comparison(op, expected):
+    assert words({'mtu': {op: '1400'}}) == [expected]
+
+
+def test_values_are_stringified():
+    assert words({'mtu': {'gt': 1400}}) == [('?>mtu=1400',)]
+
+
+def test_in():
+    assert words({'name': {'in': 'ether1,ether2'}}) == [('?=name=ether1', '?=name=ether2', '?#|')]
+    assert words({'name': {'in': 'ether1'}}) == [('?=name=ether1',)]
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('true', ('?comment',)), ('yes', ('?comment',)), ('False', ('?-comment',)), ('no', ('?-comment',)),
+])
+def test_has(value, expected):
+    assert words({'comment': {'has': value}}) == [expected]
+
+
+def test_where_conditions_are_anded():
+    assert words({'interface': 'ether1', 'mtu': {'gt': '1400', 'lt': '1500'}}) == [
+        ('?=interface=ether1',), ('?>mtu=1400',), ('?<mtu=1500',)]
+
+
+def test_any_conditions_are_ored():
+    assert words(any={'interface': 'ether1', 'comment': {'has': 'true'}}) == [
+        ('?=interface=ether1', '?comment', '?#|')]
+
+
+def test_single_any_condition_is_not_wrapped():
+    assert words(any={'interface': 'ether1'}) == [('?=interface=ether1',)]
+
+
+def test_where_and_any():
+    assert words({'disabled': 'false'}, {'interface': 'ether1', 'mtu': {'gt': '1400'}}) == [
+        ('?=disabled=false',), ('?=interface=ether1', '?>mtu=1400', '?#|')]
+
+
+def test_nothing():
+    assert compile_where() == ()
+
+
+def test_unknown_operator():
+    with pytest.raises(QueryError, match='Unknown operator "like" for "name"'):
+        compile_where({'name': {'like': 'ether'}})
+
+
+def test_has_expects_boolean():
+    with pytest.raises(QueryError, match='"has" expects true or false'):
+        compile_where(any={'comment': {'has': 'maybe'}})
@@ -0,0 +1,44 @@
+from librouteros.exceptions import TrapError
+from api.node import Node
+from api.results import operation_result
+
+
+class Batch:
+    """Connection manager replying to every command of a batch with the next result"""
+
+    def __init__(self, *results):
+        self.results = results
+
+    def batch(self, commands):
+        return list(self.results[:len(commands)])
+
+
+def post_many(*results):
+    node = Node.__new__(Node)
+    node.cm = Batch(*results)
+    return node.post_many('/ip/firewall/address-list', [{'list': 'l', 'address': str(i)} for i in range(len(results))])
+
+
+created = ({'ret': '*1'},)
+failed = TrapError(message='failure: already have such entry')
+
+
+def test_operation_result():
+    assert operation_result('post', created) == {'status': 201, 'reply': {'.id': '*1'}}
+    assert operation_result('patch', ()) == {'status': 204}
+    assert operation_result('post', failed)['status'] == 400
+
+
+def test_all_created():
+    reply, status = post_many(created, created)
+    assert status == 201 and [entry['status'] for entry in reply['results']] == [201, 201]
+
+
+def test_partial_success_is_multi_status():
+    reply, status = post_many(created, failed)
+    assert status == 207 and [entry['status'] for entry in reply['results']] == [201, 400]
+
+
+def test_all_failed():
+    reply, status = post_many(failed, failed)
+    assert status == 400
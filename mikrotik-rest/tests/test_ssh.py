@@ -0,0 +1,28 @@
+from threading import Thread
+from mtwlib.mtssh import HostLocks
+
+
+def acquire_elsewhere(locks: HostLocks, host: str) -> bool:
+    got = []
+    thread = Thread(target=lambda: got.append(locks.acquire(host, timeout=0.05)))
+    thread.start()
+    thread.join()
+    return got[0]
+
+
+def test_host_is_held_by_one_thread():
+    locks = HostLocks()
+    assert locks.acquire('r1', timeout=1)
+    assert not acquire_elsewhere(locks, 'r1')
+    assert acquire_elsewhere(locks, 'r2')  # other hosts are independent
+    locks.release('r1')
+    assert acquire_elsewhere(locks, 'r1')
+
+
+def test_unused_locks_are_dropped():
+    locks = HostLocks()
+    assert locks.acquire('r1', timeout=1)
+    assert not acquire_elsewhere(locks, 'r1')
+    assert locks.locks['r1'][1] == 1  # the failed waiter left
+    locks.release('r1')
+    assert not locks.locks
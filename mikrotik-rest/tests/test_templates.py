@@ -0,0 +1,82 @@
+import socket
+from contextlib import contextmanager
+from queue import Queue, Empty
+from threading import Thread
+from time import sleep, monotonic
+from settings import USERNAME
+from mtwlib.mtssh import Ssh
+from api import sshendpoints
+
+
+class Shell:
+    """RouterOS terminal: Ctrl-X toggles safe mode, `:delay` commands are slow"""
+
+    def __init__(self):
+        self.output = Queue()
+        self.timeout = None
+        self.sent = []
+        self.safe = False
+
+    def prompt(self) -> bytes:
+        return f'\r\n[{USERNAME}@MikroTik] {"<SAFE>" if self.safe else ">"} '.encode()
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def recv(self, size) -> bytes:
+        try:
+            return self.output.get(timeout=self.timeout)
+        except Empty:
+            raise socket.timeout()
+
+    def send(self, data: str):
+        self.sent.append(data)
+        if data == chr(0x18):
+            self.safe = not self.safe
+            self.output.put(self.prompt())
+        elif data == chr(3):
+            self.output.put(self.prompt())
+        elif data.endswith('\r\n'):
+            Thread(target=self.run, args=(data,)).start()
+
+    def run(self, command: str):
+        if command.startswith(':delay'):
+            sleep(0.5)
+        self.output.put(command.encode() + b'done' + self.prompt())
+
+
+class OneSession:
+    def __init__(self, ssh: Ssh):
+        self.ssh = ssh
+
+    @contextmanager
+    def session(self, host: str):
+        yield self.ssh
+
+
+def test_timed_out_host_is_rolled_back(monkeypatch):
+    ssh = Ssh('router', USERNAME, '', exclusive=False)
+    ssh.shell = shell = Shell()
+    monkeypatch.setattr(sshendpoints, 'ssh_pool', OneSession(ssh))
+    commands = ['/ip address add address=10.0.0.1/24 interface=ether1', ':delay 1',
+                '/ip address add address=10.0.1.1/24 interface=ether2']
+    reply, _ = sshendpoints.run_template({'hosts': ['router'], 'commands': commands, 'timeout': 0.2})
+    assert reply['hosts'][0]['errorCode'] == 504
+    deadline = monotonic() + 5
+    while chr(4) not in shell.sent and monotonic() < deadline:
+        sleep(0.01)
+    # safe mode is entered once and never released: Ctrl-D ends the session, undoing the first command
+    assert shell.sent.count(chr(0x18)) == 1 and chr(4) in shell.sent
+    assert commands[2] + '\r\n' not in shell.sent
+
+
+def test_finished_host_is_committed(monkeypatch):
+    ssh = Ssh('router', USERNAME, '', exclusive=False)
+    ssh.shell = shell = Shell()
+    monkeypatch.setattr(sshendpoints, 'ssh_pool', OneSession(ssh))
+    reply, _ = sshendpoints.run_template({'hosts': ['router'], 'commands': ['/system identity print']})
+    assert reply['hosts'][0]['reply'] == {'/system identity print': 'done'}
+    assert shell.sent.count(chr(0x18)) == 2 and chr(4) not in shell.sent
@@ -1 +1,3 @@
 from .mtssh import Ssh
+from .sshpool import SshPool
+from .transcript import Transcript, RecordingSsh, ReplaySsh
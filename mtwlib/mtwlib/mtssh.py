@@ -1,6 +1,6 @@
-import socket, time
-from collections import defaultdict
-from threading import RLock
+import codecs, re, socket, time
+from threading import Lock, RLock
+from typing import Dict, Optional, Pattern, Tuple
 from paramiko import SSHClient, AutoAddPolicy
 from contextlib import contextmanager
 
@@ -15,24 +15,73 @@ class AlreadyConnectedError(Exception):
     pass
 
 
+# terminal control sequences (colors, cursor movement), skipped when looking for the prompt
+ANSI_ESCAPE = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+
+
+class HostLocks:
+    """
+    One lock per device, held by whoever drives it: an exclusive Ssh or a pooled session.
+    A lock is dropped once nobody holds or waits for it, so hosts seen once don't pile up
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.locks: Dict[str, Tuple[RLock, int]] = {}  # lock and the number of its holders and waiters
+
+    def acquire(self, hostname: str, timeout: float) -> bool:
+        with self.lock:
+            lock, users = self.locks.get(hostname, (None, 0))
+            lock = lock or RLock()
+            self.locks[hostname] = (lock, users + 1)
+        if lock.acquire(timeout=timeout):
+            return True
+        self._leave(hostname)
+        return False
+
+    def release(self, hostname: str):
+        self.locks[hostname][0].release()
+        self._leave(hostname)
+
+    def _leave(self, hostname: str):
+        with self.lock:
+            lock, users = self.locks[hostname]
+            if users > 1:
+                self.locks[hostname] = (lock, users - 1)
+            else:
+                del self.locks[hostname]
+
+
 class Ssh:
 
-    connected_hosts = defaultdict(RLock)
+    connected_hosts = HostLocks()
 
-    def __init__(self, hostname: str, username: str, password: str, colored=True):
+    def __init__(self, hostname: str, username: str, password: str, colored=True, exclusive=True):
         self.username = username
         self.password = password
         self.hostname = hostname
         self.colored = colored
+        # exclusive=False skips the per-host lock, so several sessions
+        # (e.g. of a parallel crawler) may work with the device at once,
+        # or the caller holds it itself, as SshPool does
+        self.exclusive = exclusive
+        self.locked = False
         self.client = SSHClient()
         self.client.set_missing_host_key_policy(AutoAddPolicy())
         self.shell = None
+        # CLI prompt on the last output line, e.g. '[admin@MikroTik] /interface<SAFE> ',
+        # possibly followed by the input being edited
+        self.prompt = re.compile(r'\n[^\n]*\[{}@[^\]\n]+\][^\n]*>[^\n]*\Z'.format(re.escape(username)))
+        # whether the last read_until() got what it expected before the deadline
+        self.at_prompt = False
 
     def connect(self):
-        if not Ssh.connected_hosts[self.hostname].acquire(timeout=10):
-            raise AlreadyConnectedError(
-                f'Device {self.hostname} is busy by another ssh conn'
-            )
+        if self.exclusive and not self.locked:
+            if not Ssh.connected_hosts.acquire(self.hostname, timeout=10):
+                raise AlreadyConnectedError(
+                    f'Device {self.hostname} is busy by another ssh conn'
+                )
+            self.locked = True
         transport = self.client.get_transport()
         if not (transport and transport.active):
             modificator = '+t300w' if self.colored else '+c300w'
@@ -43,7 +92,7 @@ class Ssh:
                 look_for_keys=False,
                 allow_agent=False)
             self.shell = self.client.invoke_shell()
-            self.read_all()
+            self.read_until()
 
     def read_all(self, timeout=1) -> str:
         if self.shell.gettimeout() != timeout:
@@ -55,16 +104,61 @@ class Ssh:
             res = b''
         return res.decode('utf-8', errors='replace')
 
-    def send(self, string: str):
-        self.shell.send(chr(3))  # Ctrl-C
-        self.read_all()
+    def new_session(self) -> 'Ssh':
+        """Another, not exclusive, session to the same device"""
+        return Ssh(self.hostname, self.username, self.password, self.colored, exclusive=False)
+
+    def read_until(self, expect: Optional[Pattern] = None, timeout: float = 10) -> str:
+        """
+        Read the output until `expect` (the CLI prompt by default) matches its end
+        with terminal control sequences stripped, or until `timeout` seconds passed
+        """
+        expect = expect or self.prompt
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        deadline = time.monotonic() + timeout
+        output, tail = [], ''
+        self.at_prompt = False
+        while (left := deadline - time.monotonic()) > 0:
+            self.shell.settimeout(left)
+            try:
+                chunk = self.shell.recv(65536)
+            except socket.timeout:
+                break
+            if not chunk:  # channel closed
+                break
+            output.append(decoder.decode(chunk))
+            tail = (tail + output[-1])[-4096:]
+            if expect.search(ANSI_ESCAPE.sub('', tail)):
+                self.at_prompt = True
+                break
+        return ''.join(output)
+
+    def interrupt(self, timeout: float = 1) -> bool:
+        """Ctrl-C: stop a running command and drop anything typed, True if the prompt came back"""
+        self.shell.send(chr(3))
+        self.read_until(timeout=timeout)
+        return self.at_prompt
+
+    def send(self, string: str, interrupt=True):
+        if interrupt:
+            self.interrupt()
         self.shell.send(string)
 
+    def run(self, command: str, timeout: float = 10) -> int:
+        """Run `command` on an exec channel of its own, its exit status within `timeout` seconds"""
+        _, stdout, _ = self.client.exec_command(command, timeout=timeout)
+        channel = stdout.channel
+        deadline = time.monotonic() + timeout
+        while not channel.exit_status_ready():
+            if time.monotonic() > deadline:
+                channel.close()
+                raise socket.timeout(f'{command} did not finish within {timeout}s')
+            time.sleep(0.05)
+        return channel.recv_exit_status()
+
     def __enter__(self):
         self.connect()
-        self.client.exec_command(
-            '/system logging disable [find where action=echo disabled=no]')
-        self.read_all()
+        self.run('/system logging disable [find where action=echo disabled=no]')
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -74,25 +168,30 @@ class Ssh:
 
     def close(self):
         self.client.close()
-        Ssh.connected_hosts[self.hostname].release()
-        del Ssh.connected_hosts[self.hostname]
+        if self.locked:
+            self.locked = False
+            Ssh.connected_hosts.release(self.hostname)
 
     @contextmanager
     def safe_mode(self):
+        """
+        Changes made in the block are kept when it finishes,
+        and undone if it raises: the session is ended without releasing safe mode
+        """
         try:
-            time.sleep(3)
-            self.send(chr(3))
-            self.read_all()
-            time.sleep(3)
             for _ in range(3):
                 self.send(chr(0x18))  # Ctrl-X
-                time.sleep(0.1)
-                prompt = self.read_all()
-                if '<SAFE>' in prompt:
+                if '<SAFE>' in self.read_until():
                     break
             else:
                 raise SafeModeError('Unable to get safe mode')
             yield
-        finally:
-            self.send(chr(0x18))
-            self.read_all()
+        except BaseException:
+            try:
+                self.shell.send(chr(4))  # Ctrl-D
+            except (OSError, EOFError):
+                pass  # the session is lost, which undoes the changes as well
+            raise
+        self.send(chr(0x18))
+        # changes are kept only if the session is closed after safe mode is released
+        self.read_until()
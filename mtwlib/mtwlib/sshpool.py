@@ -0,0 +1,112 @@
+import time
+from contextlib import contextmanager
+from threading import Lock, Thread
+from typing import Dict, Iterator, Tuple
+from paramiko import SSHException
+
+from .mtssh import Ssh, AlreadyConnectedError
+
+
+class SshPool:
+    """
+    Persistent ssh sessions, one per host, borrowed by a single caller at a time.
+    A session is opened (and echo logging disabled) on the first borrow, checked
+    to be alive at the prompt on every next one and reopened if it is not.
+    Idle sessions get ssh keepalives every `keepalive` seconds and are closed
+    after `idle_timeout`. A borrowed session holds the same host lock as an exclusive Ssh,
+    so the two never drive a device at once.
+    """
+
+    def __init__(self, username: str, password: str, colored=True,
+                 idle_timeout: float = 300, keepalive: int = 30, acquire_timeout: float = 10):
+        self.username = username
+        self.password = password
+        self.colored = colored
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self.acquire_timeout = acquire_timeout
+        self.lock = Lock()
+        self.idle: Dict[str, Tuple[float, Ssh]] = {}
+        self.reaper = None
+
+    @contextmanager
+    def session(self, host: str) -> Iterator[Ssh]:
+        if not Ssh.connected_hosts.acquire(host, timeout=self.acquire_timeout):
+            raise AlreadyConnectedError(f'Device {host} is busy by another ssh conn')
+        try:
+            ssh = self._take(host)
+            try:
+                yield ssh
+            except (OSError, EOFError, SSHException):
+                self._close(ssh)
+                raise
+            except BaseException:
+                self._put(host, ssh)
+                raise
+            self._put(host, ssh)
+        finally:
+            Ssh.connected_hosts.release(host)
+
+    def _take(self, host: str) -> Ssh:
+        self._start_reaper()
+        with self.lock:
+            _, ssh = self.idle.pop(host, (None, None))
+        if ssh is not None and self._healthy(ssh):
+            return ssh
+        if ssh is not None:
+            self._close(ssh)
+        return self._open(host)
+
+    def _put(self, host: str, ssh: Ssh):
+        with self.lock:
+            self.idle[host] = (time.monotonic(), ssh)
+
+    def _open(self, host: str) -> Ssh:
+        # the caller holds the host lock for as long as it borrows the session
+        ssh = Ssh(host, self.username, self.password, self.colored, exclusive=False)
+        try:
+            ssh.__enter__()
+        except BaseException:
+            ssh.close()
+            raise
+        ssh.client.get_transport().set_keepalive(self.keepalive)
+        return ssh
+
+    @staticmethod
+    def _healthy(ssh: Ssh) -> bool:
+        """Check that the session is alive and leave it at a clean prompt"""
+        transport = ssh.client.get_transport()
+        if not (transport and transport.active):
+            return False
+        try:
+            return ssh.interrupt()
+        except (OSError, EOFError, SSHException):
+            return False
+
+    @staticmethod
+    def _close(ssh: Ssh):
+        try:
+            ssh.__exit__(None, None, None)  # enables echo logging back
+        except (OSError, EOFError, SSHException):
+            ssh.close()
+
+    def close_idle(self, older_than: float = 0):
+        """Close the sessions idle for more than `older_than` seconds"""
+        deadline = time.monotonic() - older_than
+        with self.lock:
+            expired = [host for host, (last_used, _) in self.idle.items() if last_used <= deadline]
+            sessions = [self.idle.pop(host)[1] for host in expired]
+        for ssh in sessions:
+            self._close(ssh)
+
+    def _start_reaper(self):
+        # started on first use rather than in __init__, so it survives forking workers
+        with self.lock:
+            if self.reaper is None:
+                self.reaper = Thread(target=self._reap, daemon=True)
+                self.reaper.start()
+
+    def _reap(self):
+        while True:
+            time.sleep(min(self.keepalive, self.idle_timeout))
+            self.close_idle(self.idle_timeout)
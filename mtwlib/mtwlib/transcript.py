@@ -0,0 +1,115 @@
+import json, time
+from threading import Lock
+from typing import Dict, List, Optional, Pattern, Tuple
+
+from .mtssh import Ssh
+
+
+class Transcript:
+    """What a device replied to every string sent to it, saved as JSON"""
+
+    def __init__(self, exchanges: Optional[List[Tuple[str, str]]] = None):
+        self.exchanges = exchanges or []
+        self.lock = Lock()
+
+    def record(self, sent: str, received: str):
+        with self.lock:
+            self.exchanges.append((sent, received))
+
+    def replies(self) -> Dict[str, str]:
+        return dict(self.exchanges)  # the last reply wins
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump([{'sent': sent, 'received': received} for sent, received in self.exchanges], f)
+
+    @classmethod
+    def load(cls, path: str) -> 'Transcript':
+        with open(path) as f:
+            return cls([(exchange['sent'], exchange['received']) for exchange in json.load(f)])
+
+
+class RecordingSsh(Ssh):
+    """Ssh saving every send() and the output read after it to `transcript`"""
+
+    def __init__(self, *args, transcript: Transcript, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.transcript = transcript
+        self.sent = None
+
+    def new_session(self) -> 'RecordingSsh':
+        return RecordingSsh(self.hostname, self.username, self.password, self.colored,
+                            exclusive=False, transcript=self.transcript)
+
+    def send(self, string: str, interrupt=True):
+        super().send(string, interrupt)
+        self.sent = string
+
+    def read_until(self, expect: Optional[Pattern] = None, timeout: float = 10) -> str:
+        return self._recorded(super().read_until(expect, timeout))
+
+    def read_all(self, timeout=1) -> str:
+        return self._recorded(super().read_all(timeout))
+
+    def _recorded(self, output: str) -> str:
+        if self.sent is not None:
+            self.transcript.record(self.sent, output)
+            self.sent = None
+        return output
+
+
+class ReplaySsh:
+    """
+    Stand-in for Ssh answering from a recorded transcript after `latency` seconds,
+    without a device. Strings missing from the transcript get an empty reply and are kept in `missing`
+    """
+
+    def __init__(self, transcript: Transcript, latency: float = 0,
+                 hostname='replay', username='replay', password='', colored=True):
+        self.transcript = transcript
+        self.replies = transcript.replies()
+        self.latency = latency
+        self.hostname = hostname
+        self.username = username
+        self.password = password
+        self.colored = colored
+        self.sent = None
+        self.at_prompt = False
+        self.missing = set()
+
+    def new_session(self) -> 'ReplaySsh':
+        session = ReplaySsh(self.transcript, self.latency,
+                            self.hostname, self.username, self.password, self.colored)
+        session.missing = self.missing
+        return session
+
+    def connect(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+    def send(self, string: str, interrupt=True):
+        self.sent = string
+
+    def interrupt(self, timeout: float = 1) -> bool:
+        self.sent = None
+        return True
+
+    def read_until(self, expect: Optional[Pattern] = None, timeout: float = 10) -> str:
+        time.sleep(self.latency)
+        self.at_prompt = self.sent in self.replies
+        if self.sent is not None and not self.at_prompt:
+            self.missing.add(self.sent)
+        output = self.replies.get(self.sent, '')
+        self.sent = None
+        return output
+
+    def read_all(self, timeout=1) -> str:
+        return self.read_until(timeout=timeout)
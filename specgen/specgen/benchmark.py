@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import sys
+import time
+from collections import Counter
+
+from anytree import PreOrderIter
+from mtwlib import Transcript, ReplaySsh
+
+from cliparser import TreeBuilder, ParallelTreeBuilder, extra_sessions
+from specgen import prepare_endpoints_for_template
+
+
+# Crawls a transcript recorded with SPECGEN_RECORD and builds the template data from it,
+# no device needed. Every reply takes LATENCY_MS, SESSIONS replay sessions crawl at once:
+# ./benchmark.py transcript.json [LATENCY_MS] [SESSIONS] [ROUNDS]
+# Profile with: python3 -m cProfile -s cumtime benchmark.py transcript.json
+def run(transcript: Transcript, latency: float, sessions_count: int, parse_root='/'):
+    with extra_sessions(ReplaySsh(transcript, latency), sessions_count - 1) as sessions:
+        tree_builder = ParallelTreeBuilder(sessions) if len(sessions) > 1 else TreeBuilder(sessions[0])
+        started = time.perf_counter()
+        root_node = tree_builder.get_syntax_tree(parse_root)
+        crawled = time.perf_counter()
+        endpoints, params = prepare_endpoints_for_template(root_node)
+        prepared = time.perf_counter()
+    return root_node, endpoints, sessions[0].missing, crawled - started, prepared - crawled
+
+
+if __name__ == "__main__":
+    transcript = Transcript.load(sys.argv[1])
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0
+    sessions_count = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    rounds = int(sys.argv[4]) if len(sys.argv) > 4 else 5
+    timings = []
+    for _ in range(rounds):
+        root_node, endpoints, missing, crawl_time, prepare_time = run(transcript, latency, sessions_count)
+        timings.append((crawl_time, prepare_time))
+    nodes = Counter(node.type.name for node in PreOrderIter(root_node))
+    print(f'{len(transcript.exchanges)} exchanges, {len(endpoints)} endpoints, '
+          + ', '.join(f'{count} {name}' for name, count in sorted(nodes.items())))
+    if missing:
+        # the crawler asked for something the device wasn't asked when recording
+        print(f'{len(missing)} queries not in the transcript, e.g. {sorted(missing)[0]!r}')
+    for name, values in zip(('crawl', 'prepare'), zip(*timings)):
+        print(f'{name}: best {min(values):.3f}s, mean {sum(values) / len(values):.3f}s over {rounds} rounds')
@@ -1,6 +1,7 @@
 import re
-from .tree_builder import TreeBuilder
+from .tree_builder import TreeBuilder, ParallelTreeBuilder, extra_sessions
 from .clinode import NodeType, CliNode
+from .crawl_cache import CrawlCache, tree_diff
 from mtwlib import Ssh
 
 
@@ -3,15 +3,17 @@ import sys
 from anytree import RenderTree, AsciiStyle
 from mtwlib import Ssh
 
-from cliparser import TreeBuilder
+from cliparser import TreeBuilder, ParallelTreeBuilder, extra_sessions
 
 
 def get_tree(hostname='192.168.0.99',
              username='test',
              password='test',
-             tree_root='/'):
-    with Ssh(hostname, username, password) as ssh_client:
-        tree_builder = TreeBuilder(ssh_client)
+             tree_root='/',
+             sessions_count='1'):
+    with Ssh(hostname, username, password) as ssh_client, \
+            extra_sessions(ssh_client, int(sessions_count) - 1) as sessions:
+        tree_builder = ParallelTreeBuilder(sessions) if len(sessions) > 1 else TreeBuilder(ssh_client)
         tree = tree_builder.get_syntax_tree(tree_root)
         return RenderTree(tree, style=AsciiStyle)
 
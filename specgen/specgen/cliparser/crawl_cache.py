@@ -0,0 +1,93 @@
+import json
+import os
+from typing import Dict, Optional, Tuple, Iterator
+
+from anytree import PreOrderIter
+
+from .clinode import CliNode
+
+
+def version_key(version: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in version.split('.') if part.isdigit())
+
+
+class CrawlCache:
+    """
+    Raw CLI help outputs of the crawled nodes, keyed by the query sent to the device,
+    stored in `directory` as one file per RouterOS version.
+    When the help of a node is the same as in the base version (the closest one cached,
+    older preferred), the outputs of its children may be taken from the base without querying the device.
+    """
+
+    def __init__(self, directory: str, version: str, base_version: Optional[str] = None):
+        self.directory = directory
+        self.version = version
+        self.outputs = self.load(version)
+        self.base_version = base_version or self.closest_version()
+        self.base = self.load(self.base_version) if self.base_version else {}
+
+    def path(self, version: str) -> str:
+        return os.path.join(self.directory, version + '.json')
+
+    def versions(self) -> Iterator[str]:
+        if os.path.isdir(self.directory):
+            for filename in os.listdir(self.directory):
+                if filename.endswith('.json'):
+                    yield filename[:-len('.json')]
+
+    def closest_version(self) -> Optional[str]:
+        others = sorted((v for v in self.versions() if v != self.version), key=version_key)
+        older = [v for v in others if version_key(v) < version_key(self.version)]
+        if older:
+            return older[-1]
+        return others[0] if others else None
+
+    def load(self, version: str) -> Dict[str, str]:
+        try:
+            with open(self.path(version)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.path(self.version) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.outputs, f)
+        os.replace(tmp_path, self.path(self.version))
+
+    def lookup(self, query: str, parent_unchanged: bool) -> Optional[str]:
+        """The output known without asking the device, None if it has to be queried"""
+        if query in self.outputs:  # crawled by a previous (interrupted) run of this version
+            return self.outputs[query]
+        if parent_unchanged:
+            return self.base.get(query)
+        return None
+
+    def store(self, query: str, output: str) -> bool:
+        """Remember the output, True if it is the same as in the base version"""
+        self.outputs[query] = output
+        return self.base.get(query) == output
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.save()  # also on errors, so an interrupted crawl resumes where it stopped
+
+
+def describe(root_node: CliNode) -> Dict[str, str]:
+    return {node.full_name(): getattr(node, 'param_type', '') or ''
+            for node in PreOrderIter(root_node)}
+
+
+def tree_diff(old_root: CliNode, new_root: CliNode) -> Iterator[str]:
+    """Lines of nodes added (+), removed (-) and parameters whose type changed (~)"""
+    old, new = describe(old_root), describe(new_root)
+    for name in sorted(old.keys() | new.keys()):
+        if name not in old:
+            yield f'+ {name} {new[name]}'.rstrip()
+        elif name not in new:
+            yield f'- {name} {old[name]}'.rstrip()
+        elif old[name] != new[name]:
+            yield f'~ {name} {old[name] or "?"} -> {new[name] or "?"}'
@@ -1,11 +1,15 @@
 import re
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from contextlib import contextmanager, ExitStack
 from dataclasses import dataclass
-from typing import List, Callable
+from queue import Queue
+from typing import List, Callable, Dict, Iterator, Optional, Tuple
 from enum import Enum
 from mtwlib import Ssh
 
 from .parser import Parser
 from .clinode import CliNode, NodeType
+from .crawl_cache import CrawlCache
 
 
 class Parsers(Enum):
@@ -46,19 +50,62 @@ class TreeBuilder:
                                   do_recursion=lambda node: False)
     }
 
-    def __init__(self, ssh: Ssh):
+    # the help is followed by the prompt, except for the menus completed in place
+    # (e.g. having a single item), where nothing comes and the deadline is waited out
+    help_timeout = 2
+
+    def __init__(self, ssh: Ssh, cache: Optional[CrawlCache] = None):
         self.ssh = ssh
+        self.cache = cache
 
     def get_syntax_tree(self, root='/') -> CliNode:
         root_node = CliNode(root, type=NodeType.SUBTREE)
-        self.__build_tree(root_node)
+        pending = [(root_node, False)]
+        while pending:  # depth-first, as the nodes are shown by the CLI
+            node, parent_unchanged = pending.pop()
+            output = self.cached_help(node, parent_unchanged)
+            if output is None:
+                output = self.read_help(self.ssh, node)
+            pending.extend(reversed(self.visit(node, output)))
+        return root_node
+
+    @staticmethod
+    def replay(cache: CrawlCache, root='/') -> CliNode:
+        """Rebuild the tree of `cache.version` from the stored outputs, without a device"""
+        root_node = CliNode(root, type=NodeType.SUBTREE)
+        pending = [root_node]
+        while pending:
+            node = pending.pop()
+            pending.extend(TreeBuilder.expand(node, cache.outputs.get(TreeBuilder.query(node), '')))
         return root_node
 
-    def __build_tree(self, current_node: CliNode):
-        path = str(current_node)
+    @staticmethod
+    def query(node: CliNode) -> str:
+        return str(node) + TreeBuilder.rules[node.type].ending
+
+    @staticmethod
+    def read_help(ssh: Ssh, node: CliNode) -> str:
+        ssh.send(TreeBuilder.query(node))
+        return ssh.read_until(timeout=TreeBuilder.help_timeout)
+
+    def cached_help(self, node: CliNode, parent_unchanged: bool) -> Optional[str]:
+        return self.cache.lookup(self.query(node), parent_unchanged) if self.cache else None
+
+    def visit(self, node: CliNode, output: str) -> List[Tuple[CliNode, bool]]:
+        """
+        Expand the node, return the ones to query next, each with whether its cached
+        output may be reused: only parameter types of an unchanged command are.
+        Menus and commands are always queried, as a change may be nested anywhere below them
+        """
+        unchanged = self.cache.store(self.query(node), output) if self.cache else False
+        return [(child, unchanged and child.type == NodeType.PARAM)
+                for child in self.expand(node, output)]
+
+    @staticmethod
+    def expand(current_node: CliNode, output: str) -> List[CliNode]:
+        """Add the nodes found in the CLI help output, return the ones to query next"""
         parse_rule = TreeBuilder.rules[current_node.type]
-        self.ssh.send(path + parse_rule.ending)
-        output = self.ssh.read_all()
+        next_nodes = []
         for parser in parse_rule.search_for:
             for node_fields in parser.value.finditer(output):
                 if parse_rule.create_new_node:
@@ -69,6 +116,60 @@ class TreeBuilder:
                     current_node.__dict__.update(node_fields)
                     new_node = current_node
                 if parse_rule.do_recursion(new_node):
-                    self.__build_tree(new_node)
+                    next_nodes.append(new_node)
+        return next_nodes
+
+
+class ParallelTreeBuilder(TreeBuilder):
+    """
+    Crawls independent subtrees over several ssh sessions at once.
+    Sessions only read the CLI help, the tree itself is built by the calling thread,
+    so the result is the same as TreeBuilder's.
+    """
+
+    def __init__(self, sessions: List[Ssh], cache: Optional[CrawlCache] = None):
+        super().__init__(sessions[0], cache)
+        self.sessions = sessions
+
+    def get_syntax_tree(self, root='/') -> CliNode:
+        root_node = CliNode(root, type=NodeType.SUBTREE)
+        idle: 'Queue[Ssh]' = Queue()
+        for ssh in self.sessions:
+            idle.put(ssh)
+
+        def read_help(node: CliNode) -> str:
+            ssh = idle.get()
+            try:
+                return self.read_help(ssh, node)
+            finally:
+                idle.put(ssh)
+
+        with ThreadPoolExecutor(max_workers=len(self.sessions)) as executor:
+            pending: Dict[Future, CliNode] = {}
+            ready = [(root_node, False)]
+            while ready or pending:
+                while ready:  # the cached nodes are expanded right away
+                    node, parent_unchanged = ready.pop()
+                    output = self.cached_help(node, parent_unchanged)
+                    if output is None:
+                        pending[executor.submit(read_help, node)] = node
+                    else:
+                        ready.extend(self.visit(node, output))
+                if pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        ready.extend(self.visit(pending.pop(future), future.result()))
+        return root_node
 
 
+@contextmanager
+def extra_sessions(ssh: Ssh, count: int) -> Iterator[List[Ssh]]:
+    """`ssh` and `count` more sessions to the same device for ParallelTreeBuilder"""
+    with ExitStack() as stack:
+        sessions = [ssh]
+        for _ in range(count):
+            session = ssh.new_session()
+            stack.callback(session.close)
+            session.connect()
+            sessions.append(session)
+        yield sessions
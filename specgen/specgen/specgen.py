@@ -2,12 +2,15 @@
 import sys
 import os
 from collections import defaultdict
-from typing import Dict, List, Tuple, Set
+from contextlib import ExitStack
+from typing import Dict, List, Tuple, Set, Optional
 
 from anytree import PreOrderIter
 from jinja2 import Environment, FileSystemLoader
+from mtwlib import Transcript, RecordingSsh
 
-from cliparser import TreeBuilder, CliNode, NodeType, Ssh, get_single_value
+from cliparser import TreeBuilder, ParallelTreeBuilder, extra_sessions, CliNode, NodeType, Ssh, \
+    CrawlCache, get_single_value
 from method import Method
 
 
@@ -35,20 +38,28 @@ def prepare_endpoints_for_template(root_node: CliNode) \
 
 class SpecGenerator:
 
-    def __init__(self, ssh_client: Ssh, template_filename: str, parse_root: str):
+    def __init__(self, ssh_client: Ssh, template_filename: str, parse_root: str,
+                 sessions: List[Ssh] = (), cache_dir: Optional[str] = None):
         dir, file = os.path.split(template_filename)
         self.jinja_env = Environment(loader=FileSystemLoader(searchpath=dir),
                                      trim_blocks=True, lstrip_blocks=True)
         self.template = self.jinja_env.get_template(file)
         self.parse_root = parse_root
         self.ssh_client = ssh_client
-        self.tree_builder = TreeBuilder(ssh_client)
+        self.sessions = sessions
+        self.cache_dir = cache_dir
 
     def get_spec(self) -> str:
-        root_node = self.tree_builder.get_syntax_tree(self.parse_root)
-        version = get_single_value(ssh_client=ssh_client,
+        version = get_single_value(ssh_client=self.ssh_client,
                                    cmd='/system resource print',
                                    regexp=r'(?<=version: )[0-9.]+')
+        with ExitStack() as stack:
+            cache = stack.enter_context(CrawlCache(self.cache_dir, version)) if self.cache_dir else None
+            if len(self.sessions) > 1:
+                tree_builder = ParallelTreeBuilder(self.sessions, cache)
+            else:
+                tree_builder = TreeBuilder(self.ssh_client, cache)
+            root_node = tree_builder.get_syntax_tree(self.parse_root)
         endpoints, params = prepare_endpoints_for_template(root_node)
         return self.template.render(endpoints=endpoints,
                                     mikrotik_version=version,
@@ -57,9 +68,24 @@ class SpecGenerator:
 
 if __name__ == "__main__":
     host, username, password = sys.argv[1:4]
-    with Ssh(host, username, password) as ssh_client:
-        sg = SpecGenerator(ssh_client, 'spec_template.yaml', '/')
-        print(sg.get_spec())
+    # optional 4th argument: number of ssh sessions crawling the CLI at once
+    sessions_count = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    # the CLI exchanges are saved to SPECGEN_RECORD to be replayed by benchmark.py
+    record_path = os.environ.get('SPECGEN_RECORD')
+    transcript = Transcript()
+    if record_path:
+        ssh = RecordingSsh(host, username, password, transcript=transcript)
+    else:
+        ssh = Ssh(host, username, password)
+    try:
+        with ssh as ssh_client, \
+                extra_sessions(ssh_client, sessions_count - 1) as sessions:
+            sg = SpecGenerator(ssh_client, 'spec_template.yaml', '/', sessions,
+                               cache_dir=os.environ.get('SPECGEN_CACHE_DIR'))
+            print(sg.get_spec())
+    finally:
+        if record_path:
+            transcript.save(record_path)
 
 
 
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+import sys
+
+from cliparser import TreeBuilder, CrawlCache, tree_diff
+
+
+# Prints the CLI differences between two RouterOS versions crawled into the cache:
+# ./treediff.py /path/to/cache 6.45.1 6.47
+if __name__ == "__main__":
+    cache_dir, old_version, new_version = sys.argv[1:4]
+    old_tree = TreeBuilder.replay(CrawlCache(cache_dir, old_version))
+    new_tree = TreeBuilder.replay(CrawlCache(cache_dir, new_version))
+    for line in tree_diff(old_tree, new_tree):
+        print(line)